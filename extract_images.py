@@ -2,17 +2,18 @@ import os
 import shutil
 import argparse
 
+import shared_paths  # noqa: F401 (puts updated_files on sys.path)
+import tps
+
 def extract_images_from_tps(tps_file_path, input_folder, output_folder):
     # Ensure output folder exists
     os.makedirs(output_folder, exist_ok=True)
     
-    with open(tps_file_path, 'r') as tps_file:
-        lines = tps_file.readlines()
-        
-    # Loop through the lines to find image entries
-    for line in lines:
-        if line.startswith("IMAGE="):
-            image_filename = line.split("=")[1].strip()
+    images = tps.read_tps(tps_file_path, cache=True)['im']
+
+    # Loop through the image entries
+    for image_filename in images:
+        if image_filename is not None:
             input_image_path = os.path.join(input_folder, image_filename)
             output_image_path = os.path.join(output_folder, image_filename)
             
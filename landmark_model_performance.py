@@ -1,8 +1,8 @@
-import xml.etree.ElementTree as ET
-import numpy as np
 import argparse
-import numpy as np
-from collections import defaultdict
+
+import shared_paths  # noqa: F401 (puts updated_files on sys.path)
+import landmarks
+import evaluation
 
 # maps to test to output
 # maps ground truth landmark number to model output landmark number
@@ -43,79 +43,31 @@ test_to_output_map = {
 33: 27
 }
 
-def parse_xml(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    
-    # Dictionary to store image filenames and their corresponding landmarks
-    data = {}
-    
-    for image in root.findall('.//image'):
-        image_file = image.get('file')
-        parts = {}
-        for part in image.findall('.//part'):
-            part_name = int(part.get('name'))
-            x = float(part.get('x'))
-            y = float(part.get('y'))
-            parts[part_name] = (x, y)
-        
-        data[image_file] = parts
-    
-    return data
-
-def calculate_avg_ruler_length_pixels(testData):
-    distances = []
-    for image_file, test_parts in testData.items():
-        zero_coords = None
-        one_coords = None
-        for test_part_name, test_coords in test_parts.items():
-            if test_part_name == 1:
-                one_coords = test_coords
-            elif test_part_name == 0:
-                zero_coords = test_coords
-        diff_x = zero_coords[0] - one_coords[0]
-        diff_y = zero_coords[1] - one_coords[1]
-        diff = np.sqrt(diff_x**2 + diff_y**2)
-        distances.append(diff)
-    return np.mean(distances)
-
-def calculate_differences(outputData, testData):
-    differencesMap = defaultdict(list)
-
-    for image_file, output_parts in outputData.items():
-        if image_file in testData:
-            test_parts = testData[image_file]
-            for test_part_name, test_coords in test_parts.items():
-                if test_part_name in test_to_output_map:
-                    output_part_name = test_to_output_map[test_part_name]
-                    if output_part_name in output_parts:
-                        output_coords = output_parts[output_part_name]
-                        diff_x = test_coords[0] - output_coords[0]
-                        diff_y = test_coords[1] - output_coords[1]
-                        diff = np.sqrt(diff_x**2 + diff_y**2)
-                        differencesMap[test_part_name].append(round(diff, 2))
-
-    return differencesMap
-
-def main(output_xml, test_xml):
+def main(output_xml, test_xml, percentiles=None):
     # Parse the XML files
-    output_data = parse_xml(output_xml)
-    test_data = parse_xml(test_xml)
+    output_data = landmarks.load_xml(output_xml)
+    test_data = landmarks.load_xml(test_xml)
 
-    avg_ruler_length = calculate_avg_ruler_length_pixels(test_data)
-    conversion_factor = float(27 / avg_ruler_length)
+    # The ruler spans landmarks 0 and 1 of the ground truth and is 27 mm long
+    conversion_factor = evaluation.mm_per_pixel(test_data, ruler_mm=27, parts=(0, 1))
     
-    # Calculate the differences between corresponding landmarks
-    differencesMap = calculate_differences(output_data, test_data)
+    # Calculate the differences between corresponding landmarks, (images, landmarks) in pixels
+    names, part_names, errors = evaluation.landmark_errors(output_data, test_data, test_to_output_map)
+    summary = evaluation.summarize(errors * conversion_factor, axis=0, percentiles=percentiles or ())
     
-    for landmark in differencesMap:
-        avg = round(np.mean(differencesMap[landmark]) * conversion_factor, 2)
-        print("Landmark = ", landmark, " Average = ", avg)
+    for i, landmark in enumerate(part_names.tolist()):
+        if summary["count"][i] == 0:
+            continue
+        line = ["Landmark = ", landmark, " Average = ", round(summary["mean"][i], 2)]
+        for p in percentiles or ():
+            line += [f" P{p:g} = ", round(summary[f"p{p:g}"][i], 2)]
+        print(*line)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Calculate the average difference and deviation between landmarks in two XML files.")
     parser.add_argument("output_xml", type=str, help="Path to the output XML file")
     parser.add_argument("test_xml", type=str, help="Path to the test XML file")
+    parser.add_argument("-p", "--percentiles", type=float, nargs="+", default=None, help="Also print these percentiles of the differences (in mm)")
     args = parser.parse_args()
     
-    main(args.output_xml, args.test_xml)
+    main(args.output_xml, args.test_xml, args.percentiles)
@@ -1,104 +1,12 @@
-import xml.etree.ElementTree as ET
 import numpy as np
 import argparse
-import numpy as np
-from collections import defaultdict
 import matplotlib.pyplot as plt
 from scipy.stats import gaussian_kde
+import shared_paths  # noqa: F401 (puts updated_files on sys.path)
+import landmarks
+import evaluation
 
-test_to_output_map = {
-0: 0,
-1: 1,
-2: 12,
-3: 23,
-4: 28,
-5: 29,
-6: 30,
-7: 31,
-8: 32,
-9: 33,
-10: 2,
-11: 3,
-12: 4,
-13: 5,
-14: 6,
-15: 7,
-16: 8,
-17: 9,
-18: 10,
-19: 11,
-20: 13,
-21: 14,
-22: 15,
-23: 16,
-24: 17,
-25: 18,
-26: 19,
-27: 20,
-28: 21,
-29: 22,
-30: 24,
-31: 25,
-32: 26,
-33: 27
-}
-def parse_xml(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    
-    # Dictionary to store image filenames and their corresponding landmarks
-    data = {}
-    
-    for image in root.findall('.//image'):
-        image_file = image.get('file')
-        parts = {}
-        for part in image.findall('.//part'):
-            part_name = int(part.get('name'))
-            x = float(part.get('x'))
-            y = float(part.get('y'))
-            parts[part_name] = (x, y)
-        
-        data[image_file] = parts
-    return data
 
-def calcuate_ruler_length(testData):
-    # calculate length of each staple
-    distances = []
-    for image_file, test_parts in testData.items():
-        zero_coords = None
-        one_coords = None
-        for test_part_name, test_coords in test_parts.items():
-            if test_part_name == 1:
-                one_coords = test_coords
-            elif test_part_name == 0:
-                zero_coords = test_coords
-        diff_x = zero_coords[0] - one_coords[0]
-        diff_y = zero_coords[1] - one_coords[1]
-        diff = np.sqrt(diff_x**2 + diff_y**2)
-        distances.append(diff)
-    return distances
-    
-def calculate_differences(outputData, testData):
-    # calculate difference between ground truth and test for each landmark
-    differencesMap = defaultdict(list)
-    Lengths = defaultdict(list)
-    
-    for image_file, output_parts in outputData.items():
-        print(output_parts)
-        if image_file.replace('./', '') in testData:
-            test_parts = testData[image_file.replace('./', '')]
-            for test_part_name, test_coords in test_parts.items():
-                if test_part_name in test_to_output_map:
-                    output_part_name = test_to_output_map[test_part_name]
-                    if output_part_name in output_parts:
-                        output_coords = output_parts[output_part_name]
-                        diff_x = test_coords[0] - output_coords[0]
-                        diff_y = test_coords[1] - output_coords[1]
-                        length = np.sqrt(diff_x**2 + diff_y**2)
-                        differencesMap[test_part_name].append([diff_x, diff_y])
-                        Lengths[test_part_name].append(length)
-
-    return differencesMap, Lengths
 def plot_hist(ax, data, title, color='blue'):
     ax.hist(data, bins=30, edgecolor='black', color=color)
     ax.set_title(title)
@@ -107,20 +15,15 @@ def plot_hist(ax, data, title, color='blue'):
 
 def main(output_xml, test_xml, landmark):
     # Parse the XML files
-    output_data = parse_xml(output_xml)
-    test_data = parse_xml(test_xml)
-    ruler_length = calcuate_ruler_length(test_data)
-    length = []
-    x_coords = []
-    y_coords = []
-    i = 0
-    print("./" + list(test_data.keys())[0])
-    for i in range(len(test_data.keys())):
-        diff_x = test_data[list(test_data.keys())[i]][landmark][0] - output_data["./" + list(test_data.keys())[i]][landmark][0]
-        x_coords.append(diff_x * float(27 / ruler_length[i]))
-        diff_y = test_data[list(test_data.keys())[i]][landmark][1] - output_data["./" + list(test_data.keys())[i]][landmark][1]
-        y_coords.append(diff_y * float(27 / ruler_length[i]))
-        length.append(np.sqrt(x_coords[-1]**2 + y_coords[-1]**2))
+    output_data = landmarks.load_xml(output_xml)
+    test_data = landmarks.load_xml(test_xml)
+
+    # Residuals of every image in mm, matched by image name; images missing the landmark are left out
+    _, part_names, residuals = evaluation.scaled_residuals(output_data, test_data)
+    residuals = residuals[:, part_names.tolist().index(landmark)]
+    residuals = residuals[~np.isnan(residuals[:, 0])]
+    x_coords, y_coords = residuals[:, 0], residuals[:, 1]
+    length = np.hypot(x_coords, y_coords)
 
     data = np.vstack([x_coords, y_coords])
     kde = gaussian_kde(data, bw_method='scott')
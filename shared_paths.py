@@ -0,0 +1,8 @@
+# The scripts at the root of the repository share the tps, landmark and evaluation modules of
+# updated_files. Importing this module puts that folder on sys.path, wherever the script is run from.
+import os
+import sys
+
+SHARED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "updated_files")
+if SHARED_DIR not in sys.path:
+    sys.path.insert(0, SHARED_DIR)
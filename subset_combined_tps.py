@@ -3,6 +3,9 @@ import matplotlib.pyplot as plt
 from PIL import Image
 import os
 import cv2
+
+import shared_paths  # noqa: F401 (puts updated_files on sys.path)
+import tps
 def read_comma_delimited_file(file_path):
     """Read a comma-delimited text file and return lists of processed and dorsal image filenames."""
     processed_images = []
@@ -35,40 +38,11 @@ def read_comma_delimited_file_2(file_path):
 
     return image_names, image_quality, image_notes
 def read_tps_file_validated(file_path, valid_images):
-    """Read a TPS file and return data for entries that match valid image names."""
-    data = []
-    current_x = []
-    current_y = []
-    current_image = None
-    with open(file_path, 'r') as file:
-        for line in file:
-            line = line.strip()
-            if line.startswith('LM='):
-                # Start reading landmarks
-                reading_landmarks = True
-                current_x = []  # Reset coordinates for the new entry
-                current_y = []
-            elif line.startswith('IMAGE='):
-                current_image = line[6:]
-                # print("possible image", line[6:])
-                if current_image != None and current_image in valid_images:
-                    # print("Current Image", current_image)
-                    # index = valid_images.index(current_image)
-                    data.append((current_image, current_x, current_y))
-                current_image = line.split('=')[1]
-                current_x = []  # Reset coordinates for the new entry
-                current_y = []
-                reading_landmarks = False
-            elif reading_landmarks and line:  # Process point lines
-                points = list(map(float, line.split()))
-                current_x.append(points[0])
-                current_y.append(points[1])
-    
-        # Add the last entry if it matches and has coordinates
-        if current_image and current_image in valid_images and current_x and current_y:
-            data.append((current_image, current_x, current_y))
-
-    return data
+    """Read a TPS file and return the coordinates and image names of the entries that match valid image names."""
+    data = tps.read_tps(file_path, cache=True)
+    valid_images = set(valid_images)
+    keep = [i for i, image in enumerate(data['im']) if image in valid_images]
+    return {'im': [data['im'][i] for i in keep], 'coords': [data['coords'][i] for i in keep]}
 if __name__ == "__main__":
     # updated_morph\image_mapping.txt
     txt_names = "image_mapping.txt"
@@ -87,20 +61,8 @@ if __name__ == "__main__":
         # print(dorsal_names[i], auto_names[-1])
     print(auto_names[0], dorsal_names[0])
     new_dorsal_tps = read_tps_file_validated("combined_manual.tps", dorsal_names)
-    print(new_dorsal_tps[0])
-    with open("subset_manual.tps", "w") as file:
-        for i in range(len(new_dorsal_tps)):
-            lm = len(new_dorsal_tps[i][1])
-            file.write(f"LM={lm}\n")
-            for j in range(len(new_dorsal_tps[i][1])):
-                file.write(f"{new_dorsal_tps[i][1][j]} {new_dorsal_tps[i][2][j]}\n")
-            file.write(f"IMAGE={new_dorsal_tps[i][0]}\n")
+    print(new_dorsal_tps['im'][0], new_dorsal_tps['coords'][0])
+    tps.write_tps("subset_manual.tps", new_dorsal_tps['coords'], images=new_dorsal_tps['im'])
     new_processed_tps = read_tps_file_validated("combined.tps", auto_names)
-    with open("subset_auto.tps", "w") as file:
-        for i in range(len(new_processed_tps)):
-            lm = len(new_processed_tps[i][1])
-            file.write(f"LM={lm}\n")
-            for j in range(len(new_processed_tps[i][1])):
-                file.write(f"{new_processed_tps[i][1][j]} {new_processed_tps[i][2][j]}\n")
-            file.write(f"IMAGE={new_processed_tps[i][0]}\n")
-    print(len(new_processed_tps))
\ No newline at end of file
+    tps.write_tps("subset_auto.tps", new_processed_tps['coords'], images=new_processed_tps['im'])
+    print(len(new_processed_tps['im']))
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts are run from the repository root, and shared_paths makes updated_files importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shared_paths  # noqa: E402,F401
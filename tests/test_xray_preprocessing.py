@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+pydicom = pytest.importorskip("pydicom")
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, SecondaryCaptureImageStorage, generate_uid
+
+import xray_preprocessing
+
+
+def write_dicom(path, pixels, **elements):
+    """Write an uncompressed single frame DICOM file holding pixels."""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.preamble = b"\0" * 128
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 8 * pixels.dtype.itemsize
+    ds.HighBit = ds.BitsStored - 1
+    ds.PixelRepresentation = int(pixels.dtype.kind == "i")
+    for name, value in elements.items():
+        setattr(ds, name, value)
+    ds.PixelData = pixels.astype(pixels.dtype.newbyteorder("<")).tobytes()
+    ds.save_as(path)
+    return path
+
+
+@pytest.mark.parametrize(
+    "dtype, elements",
+    [
+        (np.uint16, {}),
+        (np.uint16, {"WindowCenter": 30000, "WindowWidth": 20000, "VOILUTFunction": "LINEAR"}),
+        (np.uint16, {"PhotometricInterpretation": "MONOCHROME1"}),
+        (np.uint8, {}),
+        (np.int16, {}),
+        # Fewer bits stored than allocated: the random values also fill the unused high bits
+        (np.uint16, {"BitsStored": 12, "HighBit": 11}),
+        (np.uint16, {"BitsStored": 14, "HighBit": 13, "PhotometricInterpretation": "MONOCHROME1"}),
+        (np.int16, {"BitsStored": 12, "HighBit": 11}),
+    ],
+)
+def test_low_memory_matches_dcm_to_jpeg(tmp_path, dtype, elements):
+    info = np.iinfo(dtype)
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(info.min // 2 + 1000, info.max // 2 + 1000, size=(300, 200)).astype(dtype)
+    dcm = write_dicom(str(tmp_path / "image.dcm"), pixels, **elements)
+    # Uncompressed files are read strip by strip from the file, not through pixel_array
+    dicom = pydicom.dcmread(dcm, defer_size="64 KB")
+    assert xray_preprocessing.pixel_data_memmap(dicom, dcm) is not None
+
+    outputs = []
+    for low_memory in (False, True):
+        jpeg = str(tmp_path / f"image_{low_memory}.jpg")
+        xray_preprocessing.dcm_to_jpeg(dcm, jpeg, grayscale=True, low_memory=low_memory, strip_rows=64)
+        outputs.append(np.asarray(Image.open(jpeg)))
+
+    # The stretched image spans the whole 0-255 range, it is not saturated
+    assert outputs[0].min() < 10 and outputs[0].max() > 245
+    np.testing.assert_array_equal(outputs[1], outputs[0])
+
+
+@pytest.mark.parametrize("channels", [1, 3])
+@pytest.mark.parametrize("sharpness, contrast", [(4, 1.3), (7.3, 2.2), (0.5, 0.7), (2.6, 1.0)])
+def test_enhance_image_matches_pil(channels, sharpness, contrast):
+    rng = np.random.default_rng(channels)
+    shape = (120, 90) if channels == 1 else (120, 90, 3)
+    img = rng.integers(0, 256, size=shape, dtype=np.uint8)
+    # Half noise, half smooth gradient, so that both the clipped and the unclipped blends are covered
+    gradient = np.linspace(0, 255, 90).astype(np.uint8)
+    img[60:] = gradient[:, None] if channels == 3 else gradient
+
+    result = xray_preprocessing.enhance_image(img, sharpness, contrast)
+    bgr = img if channels == 3 else np.stack((img,) * 3, axis=-1)
+    expected = xray_preprocessing.enhance_image_pil(bgr, sharpness, contrast)
+    if channels == 1:
+        expected = expected[..., 0]
+
+    # Same arithmetic as PIL's blend, so no tolerance: every pixel is identical
+    assert result.shape == expected.shape
+    np.testing.assert_array_equal(result, expected)
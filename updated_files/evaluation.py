@@ -0,0 +1,207 @@
+# Part of the standard library
+from itertools import repeat
+
+# Not part of the standard library
+import numpy as np
+
+
+# Vectorized comparison of predicted and ground truth landmarks
+
+
+def align(predicted, groundtruth, part_map=None):
+    """
+    Aligns the landmarks of two datasets. Images are matched by their normalized file name and
+    landmarks through part_map, turned into index arrays once, so the result is two arrays of
+    the same shape that can be compared directly.
+
+    Parameters:
+    ----------
+        predicted (LandmarkDataset): model predictions
+        groundtruth (LandmarkDataset): ground truth landmarks
+        part_map (dict): (optional) ground truth landmark name -> predicted landmark name.
+            Landmarks with the same names are paired when it is not given
+
+    Returns:
+    ----------
+        names (ndarray): image file of each ground truth specimen found in the predictions
+        part_names (ndarray): ground truth name of each aligned landmark
+        truth (ndarray): (images, landmarks, 2) float32 ground truth coordinates
+        pred (ndarray): (images, landmarks, 2) float32 predicted coordinates. Landmarks missing from
+            either dataset are NaN
+    """
+    if part_map is None:
+        part_map = {name: name for name in groundtruth.part_names.tolist()}
+    truth_cols = groundtruth.columns(list(part_map.keys()))
+    pred_cols = predicted.columns(list(part_map.values()))
+    keep = (truth_cols >= 0) & (pred_cols >= 0)
+    truth_cols, pred_cols = truth_cols[keep], pred_cols[keep]
+    part_names = np.array(list(part_map.keys()))[keep]
+
+    # One ground truth specimen per image, paired with the first prediction for that image. Both
+    # indexes are keyed by normalized name, so the images are matched without renormalizing.
+    count = len(groundtruth.index)
+    truth_rows = np.fromiter(groundtruth.index.values(), dtype=np.intp, count=count)
+    if list(predicted.index) == list(groundtruth.index):
+        # Usual case, both files list the same images in the same order: no lookups needed
+        pred_rows = np.fromiter(predicted.index.values(), dtype=np.intp, count=count)
+    else:
+        pairs = map(predicted.index.get, groundtruth.index, repeat(-1))
+        pred_rows = np.fromiter(pairs, dtype=np.intp, count=count)
+        found = pred_rows >= 0
+        truth_rows, pred_rows = truth_rows[found], pred_rows[found]
+
+    return (
+        groundtruth.names[truth_rows],
+        part_names,
+        _take(groundtruth.coords, truth_rows, truth_cols),
+        _take(predicted.coords, pred_rows, pred_cols),
+    )
+
+
+def _take(coords, rows, cols):
+    """
+    Internal function used by align. Copies some rows and columns of a coordinate array, skipping
+    the column copy when every column is kept in order.
+    """
+    coords = coords.take(rows, axis=0)
+    if not np.array_equal(cols, np.arange(coords.shape[1])):
+        coords = coords.take(cols, axis=1)
+    return coords
+
+
+def landmark_errors(predicted, groundtruth, part_map=None):
+    """
+    Computes the distance between every predicted landmark and its ground truth.
+
+    Parameters:
+    ----------
+        predicted (LandmarkDataset): model predictions
+        groundtruth (LandmarkDataset): ground truth landmarks
+        part_map (dict): (optional) ground truth landmark name -> predicted landmark name
+
+    Returns:
+    ----------
+        names (ndarray): image file of each row of errors
+        part_names (ndarray): ground truth landmark name of each column of errors
+        errors (ndarray): (images, landmarks) distances in pixels, NaN where a landmark is
+            missing from either dataset
+    """
+    names, part_names, truth, pred = align(predicted, groundtruth, part_map)
+    diff = truth - pred
+    return names, part_names, np.hypot(diff[..., 0], diff[..., 1]).astype(np.float64)
+
+
+def ruler_lengths(dataset, parts=(0, 1)):
+    """
+    Computes the length of the ruler of every specimen, i.e. the distance between two of its
+    landmarks.
+
+    Parameters:
+    ----------
+        dataset (LandmarkDataset): landmarks
+        parts (tuple): names of the landmarks at both ends of the ruler
+
+    Returns:
+    ----------
+        lengths (ndarray): ruler length of each specimen in pixels, NaN when an end is missing
+    """
+    cols = dataset.columns(list(parts))
+    if (cols < 0).any():
+        return np.full(len(dataset), np.nan)
+    ends = dataset.coords[:, cols].astype(np.float64)
+    return np.linalg.norm(ends[:, 0] - ends[:, 1], axis=1)
+
+
+def mm_per_pixel(dataset, ruler_mm=27, parts=(0, 1)):
+    """
+    Computes the factor converting pixels to millimetres from the average ruler length of a
+    dataset.
+
+    Parameters:
+    ----------
+        dataset (LandmarkDataset): landmarks, usually the ground truth
+        ruler_mm (float): length of the ruler in millimetres
+        parts (tuple): names of the landmarks at both ends of the ruler
+
+    Returns:
+    ----------
+        factor (float): millimetres per pixel
+    """
+    return float(ruler_mm / np.nanmean(ruler_lengths(dataset, parts)))
+
+
+def scaled_residuals(predicted, groundtruth, ruler_mm=27, parts=(0, 1), part_map=None):
+    """
+    Computes the residuals (ground truth minus prediction) of every aligned landmark in
+    millimetres, scaling each image by the length of its own ruler in the ground truth.
+
+    Parameters:
+    ----------
+        predicted (LandmarkDataset): model predictions
+        groundtruth (LandmarkDataset): ground truth landmarks
+        ruler_mm (float): length of the ruler in millimetres
+        parts (tuple): names of the landmarks at both ends of the ruler
+        part_map (dict): (optional) ground truth landmark name -> predicted landmark name
+
+    Returns:
+    ----------
+        names (ndarray): image file of each row of residuals
+        part_names (ndarray): ground truth landmark name of each column of residuals
+        residuals (ndarray): (images, landmarks, 2) x and y residuals in millimetres, NaN where a
+            landmark is missing from either dataset
+    """
+    names, part_names, truth, pred = align(predicted, groundtruth, part_map)
+    ruler = ruler_lengths(groundtruth, parts)[groundtruth.rows(names)]
+    residuals = (truth - pred) * (ruler_mm / ruler)[:, None, None]
+    return names, part_names, residuals
+
+
+def summarize(errors, axis=0, percentiles=(50, 90, 95)):
+    """
+    Summarizes landmark errors per landmark (axis=0) or per image (axis=1), ignoring missing
+    landmarks.
+
+    Parameters:
+    ----------
+        errors (ndarray): (images, landmarks) errors, e.g. from landmark_errors
+        axis (int): 0 for one value per landmark, 1 for one value per image
+        percentiles (list): percentiles reported
+
+    Returns:
+    ----------
+        summary (dict): 'count', 'mean', 'std', 'max' and one 'p<percentile>' entry, each an
+            array with one value per landmark (or image). Entries without any error are NaN
+    """
+    # One row per landmark (or image), holding the errors it is summarized over
+    rows = errors.T if axis == 0 else errors
+    missing = np.isnan(rows)
+    count = rows.shape[1] - np.sum(missing, axis=1)
+    valid = count > 0
+    summary = {"count": count}
+    # Only rows with errors are summarized, the others stay NaN
+    kept, missing, n = rows[valid], missing[valid], count[valid]
+
+    # Same arithmetic as np.nanmean and np.nanstd, without their copies of the whole array
+    filled = np.where(missing, 0, kept)
+    mean = np.sum(filled, axis=1) / n
+    filled -= mean[:, None]
+    filled[missing] = 0
+    np.multiply(filled, filled, out=filled)
+    std = np.sqrt(np.sum(filled, axis=1) / n)
+
+    # np.nanpercentile falls back to a Python loop over rows containing NaN. Sorting moves the
+    # NaNs to the end of each row, so the maximum is the last of the first count values and the
+    # percentiles are interpolated among them, as np.percentile's linear method does.
+    ordered = np.sort(kept, axis=1)
+    r = np.arange(len(ordered))
+    for name, values in {"mean": mean, "std": std, "max": ordered[r, n - 1]}.items():
+        summary[name] = np.full(len(count), np.nan)
+        summary[name][valid] = values
+    for p in percentiles:
+        position = (n - 1) * (p / 100)
+        low = np.floor(position).astype(np.intp)
+        high = np.minimum(low + 1, n - 1)
+        below, above = ordered[r, low], ordered[r, high]
+        summary[f"p{p:g}"] = np.full(len(count), np.nan)
+        summary[f"p{p:g}"][valid] = below + (position - low) * (above - below)
+    return summary
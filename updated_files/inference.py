@@ -36,17 +36,106 @@ ap.add_argument(
     help=" (optional) prevents landmarks of choice from being output",
     metavar="",
 )
-
-
-print(utils.predictions_to_xml)
-args = vars(ap.parse_args())
-print(vars(ap.parse_args()))
-utils.predictions_to_xml(
-    args["predictor"],
-    folder=args["input_dir"],
-    ignore=args["ignore_list"],
-    output=args["out_file"],
+ap.add_argument(
+    "-d",
+    "--detector",
+    type=str,
+    default=None,
+    help="(optional) trained object detection model, e.g. detector.svm. If given, landmarks are only predicted in a padded crop around the detected box, which the shape predictor sees as a full-frame box as in training",
+    metavar="",
+)
+ap.add_argument(
+    "-ds",
+    "--detector-scale",
+    type=float,
+    default=0.25,
+    help="scaling factor applied to the images before detection (default = 0.25)",
+    metavar="",
+)
+ap.add_argument(
+    "-s",
+    "--scales",
+    nargs="+",
+    type=float,
+    default=[0.25, 0.5, 1],
+    help="scaling factors at which the landmarks are predicted (default = 0.25 0.5 1)",
+    metavar="",
+)
+ap.add_argument(
+    "-k",
+    "--blur-kernel",
+    type=int,
+    default=7,
+    help="size of the box filter applied before prediction, 0 disables it (default = 7)",
+    metavar="",
+)
+ap.add_argument(
+    "-b",
+    "--bilateral",
+    nargs=3,
+    type=float,
+    default=[9, 41, 21],
+    help="diameter, sigma color and sigma space of the bilateral filter, a diameter of 0 disables it (default = 9 41 21)",
+    metavar="",
+)
+ap.add_argument(
+    "-fl",
+    "--filter-per-level",
+    action="store_true",
+    help="filter every scale separately instead of filtering the largest scale and downsampling it",
+)
+ap.add_argument(
+    "-c",
+    "--cache",
+    type=str,
+    default=None,
+    help="(optional) sqlite file caching the predictions. Re-running only predicts new or modified images",
+    metavar="",
+)
+ap.add_argument(
+    "-f",
+    "--formats",
+    nargs="+",
+    choices=["xml", "csv", "tps", "parquet"],
+    default=["xml", "csv", "tps"],
+    help="output formats, all written in a single pass (default = xml csv tps)",
+    metavar="",
 )
+ap.add_argument(
+    "-g",
+    "--grayscale",
+    action="store_true",
+    help="read and filter the images as a single channel (faster, x-rays carry no colour)",
+)
+ap.add_argument(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="number of worker processes used for prediction (default = 1)",
+    metavar="",
+)
+
 
-utils.dlib_xml_to_pandas(args["out_file"])
-utils.dlib_xml_to_tps(args["out_file"])
+# The worker processes re-import this script when they are spawned (Windows, macOS), so the
+# prediction only runs in the main process
+if __name__ == "__main__":
+    print(utils.predictions_to_xml)
+    args = vars(ap.parse_args())
+    print(vars(ap.parse_args()))
+    utils.predictions_to_xml(
+        args["predictor"],
+        folder=args["input_dir"],
+        ignore=args["ignore_list"],
+        output=args["out_file"],
+        workers=args["workers"],
+        detector_name=args["detector"],
+        detector_scale=args["detector_scale"],
+        scales=args["scales"],
+        blur_kernel=args["blur_kernel"],
+        bilateral=(int(args["bilateral"][0]), args["bilateral"][1], args["bilateral"][2]),
+        filter_per_level=args["filter_per_level"],
+        cache=args["cache"],
+        formats=args["formats"],
+        grayscale=args["grayscale"],
+    )
@@ -1,132 +1,11 @@
-import xml.etree.ElementTree as ET
 import numpy as np
 import argparse
 import numpy as np
-from collections import defaultdict
 import matplotlib.pyplot as plt
 from scipy.stats import gaussian_kde
 import os
-
-test_to_output_map = {
-0: 0,
-1: 1,
-2: 12,
-3: 23,
-4: 28,
-5: 29,
-6: 30,
-7: 31,
-8: 32,
-9: 33,
-10: 2,
-11: 3,
-12: 4,
-13: 5,
-14: 6,
-15: 7,
-16: 8,
-17: 9,
-18: 10,
-19: 11,
-20: 13,
-21: 14,
-22: 15,
-23: 16,
-24: 17,
-25: 18,
-26: 19,
-27: 20,
-28: 21,
-29: 22,
-30: 24,
-31: 25,
-32: 26,
-33: 27
-}
-def parse_xml(file_path):
-    '''
-    Parses an XML file containing image data and landmark coordinates. This function extracts the filenames of images and their corresponding landmarks, storing them in a dictionary for further processing.
-
-    Parameters:
-        file_path (str): Path to the XML file that contains image data and landmark information.
-
-    Returns:
-        data (dict): A dictionary where keys are image filenames and values are dictionaries of landmarks. Each landmark is represented as a tuple of (x, y) coordinates.
-    '''
-
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    
-    # Dictionary to store image filenames and their corresponding landmarks
-    data = {}
-    
-    for image in root.findall('.//image'):
-        image_file = image.get('file')
-        parts = {}
-        for part in image.findall('.//part'):
-            part_name = int(part.get('name'))
-            x = float(part.get('x'))
-            y = float(part.get('y'))
-            parts[part_name] = (x, y)
-        
-        data[image_file] = parts
-    return data
-
-def calcuate_ruler_length(testData):
-    '''
-    Calculates the length of staples based on landmark coordinates. This function iterates over the provided test data, extracting the coordinates of specified landmarks and computing the Euclidean distance between them.
-
-    Parameters:
-        testData (dict): A dictionary where keys are image filenames and values are dictionaries of landmark coordinates. Each landmark is identified by its name.
-
-    Returns:
-        distances (list): A list of calculated distances (lengths of staples) for each image, corresponding to the Euclidean distance between landmarks 0 and 1.
-    '''
-    distances = []
-    for image_file, test_parts in testData.items():
-        zero_coords = None
-        one_coords = None
-        for test_part_name, test_coords in test_parts.items():
-            if test_part_name == 1:
-                one_coords = test_coords
-            elif test_part_name == 0:
-                zero_coords = test_coords
-        diff_x = zero_coords[0] - one_coords[0]
-        diff_y = zero_coords[1] - one_coords[1]
-        diff = np.sqrt(diff_x**2 + diff_y**2)
-        distances.append(diff)
-    return distances
-    
-def calculate_differences(outputData, testData):
-    '''
-    Computes the differences between ground truth landmark coordinates and predicted landmark coordinates from model output. This function maps landmarks from the test data to output data, calculates the coordinate differences, and computes the Euclidean distances for each landmark.
-
-    Parameters:
-        outputData (dict): A dictionary where keys are image filenames and values are dictionaries of predicted landmark coordinates.
-        testData (dict): A dictionary where keys are image filenames and values are dictionaries of ground truth landmark coordinates.
-
-    Returns:
-        differencesMap (defaultdict): A dictionary mapping each landmark to a list of coordinate differences [diff_x, diff_y] for all corresponding landmarks across images.
-        Lengths (defaultdict): A dictionary mapping each landmark to a list of computed lengths (Euclidean distances) for all corresponding landmarks across images.
-    '''
-    differencesMap = defaultdict(list)
-    Lengths = defaultdict(list)
-    
-    for image_file, output_parts in outputData.items():
-        if image_file.replace('./', '') in testData:
-            test_parts = testData[image_file.replace('./', '')]
-            for test_part_name, test_coords in test_parts.items():
-                if test_part_name in test_to_output_map:
-                    output_part_name = test_to_output_map[test_part_name]
-                    if output_part_name in output_parts:
-                        output_coords = output_parts[output_part_name]
-                        diff_x = test_coords[0] - output_coords[0]
-                        diff_y = test_coords[1] - output_coords[1]
-                        length = np.sqrt(diff_x**2 + diff_y**2)
-                        differencesMap[test_part_name].append([diff_x, diff_y])
-                        Lengths[test_part_name].append(length)
-
-    return differencesMap, Lengths
+import landmarks
+import evaluation
 
 def main(output_xml, test_xml, output_folder):
     '''
@@ -143,27 +22,23 @@ def main(output_xml, test_xml, output_folder):
     '''
 
     # Parse the XML files
-    output_data = parse_xml(output_xml)
-    test_data = parse_xml(test_xml)
-    ruler_length = calcuate_ruler_length(test_data)
+    output_data = landmarks.load_xml(output_xml)
+    test_data = landmarks.load_xml(test_xml)
     os.makedirs(output_folder, exist_ok=True)
-    length = []
-    x_coords = []
-    y_coords = []
 
-    # print(len(test_data[list(test_data.keys())[0]]))
-    for landmark in range(len(test_data[list(test_data.keys())[0]])):
-        x_coords = []
-        y_coords = []
-        length = []
-        for i in range(len(test_data.keys())):
-            diff_x = test_data[list(test_data.keys())[i]][landmark][0] - output_data["./" + list(test_data.keys())[i]][landmark][0]
-            x_coords.append(diff_x * float(27 / ruler_length[i]))
-            diff_y = test_data[list(test_data.keys())[i]][landmark][1] - output_data["./" + list(test_data.keys())[i]][landmark][1]
-            y_coords.append(diff_y * float(27 / ruler_length[i]))
-            length.append(np.sqrt(x_coords[-1]**2 + y_coords[-1]**2))
+    # (images, landmarks, 2) residuals in mm, computed once for every landmark
+    _, part_names, residuals = evaluation.scaled_residuals(output_data, test_data)
+    lengths = np.hypot(residuals[..., 0], residuals[..., 1])
+
+    for j, landmark in enumerate(part_names.tolist()):
+        # Images missing this landmark are left out of the plots; indices still refer to images
+        present = ~np.isnan(lengths[:, j])
+        x_coords = residuals[present, j, 0]
+        y_coords = residuals[present, j, 1]
+        length = lengths[present, j]
+        image_index = np.flatnonzero(present)
         threshold = 1
-        outliers = np.array(length) > threshold
+        outliers = length > threshold
 
 
         data = np.vstack([x_coords, y_coords])
@@ -183,9 +58,9 @@ def main(output_xml, test_xml, output_folder):
         
         ax[0].scatter(0, 0)
         ax[0].scatter(x_coords, y_coords, s=5, color='red', alpha=0.5)
-        print(np.where(outliers)[0])
+        print(image_index[outliers])
         for i in np.where(outliers)[0]:
-            ax[0].annotate(i, (x_coords[i], y_coords[i]), textcoords="offset points", xytext=(0,10), ha='center', fontsize=8, color='red')
+            ax[0].annotate(image_index[i], (x_coords[i], y_coords[i]), textcoords="offset points", xytext=(0,10), ha='center', fontsize=8, color='red')
         ax[1].hist(length, bins = 10)
         ax_polar = plt.subplot(1, 3, 3, projection='polar')
 
@@ -0,0 +1,237 @@
+# Part of the standard library
+import xml.etree.ElementTree as ET
+import csv
+
+# Not part of the standard library
+import numpy as np
+import tps
+
+
+# Columnar landmark dataset shared by the inference, preprocessing and evaluation tools
+
+
+def normalize_name(name):
+    """
+    Normalizes an image file name so that the same image is found whether it was written as
+    './test/a.jpg', 'test\\a.jpg' or 'test/a.jpg'.
+
+    Parameters:
+    ----------
+        name (str): image file name
+
+    Returns:
+    ----------
+        name (str): normalized image file name
+    """
+    name = name.replace("\\", "/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name
+
+
+class LandmarkDataset:
+    """
+    Landmark coordinates of a set of specimens held in contiguous NumPy arrays. There is one
+    specimen per bounding box, so an image with several boxes has several rows.
+
+    Attributes:
+    ----------
+        names (ndarray): image file of each specimen, as written in the source file
+        coords (ndarray): (specimens, parts, 2) float32 landmark coordinates. Landmarks missing
+            from a specimen are NaN
+        boxes (ndarray): (specimens, 4) int32 box top, left, width and height. -1 when the
+            source file has no boxes
+        part_names (ndarray): landmark name of each column of coords
+        index (dict): normalized image name -> row of its first specimen
+    """
+
+    def __init__(self, names, coords, boxes=None, part_names=None):
+        self.names = np.asarray(names, dtype=object)
+        coords = np.asarray(coords, dtype=np.float32)
+        if coords.ndim != 3:
+            coords = coords.reshape(len(self.names), -1 if len(self.names) else 0, 2)
+        self.coords = coords
+        if boxes is None:
+            boxes = np.full((len(self.names), 4), -1)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(len(self.names), 4)
+        if part_names is None:
+            part_names = np.arange(self.coords.shape[1])
+        self.part_names = np.asarray(part_names)
+        self.index = {}
+        for row, name in enumerate(self.names):
+            self.index.setdefault(normalize_name(name), row)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, name):
+        """
+        Returns the row of the first specimen of an image.
+
+        Parameters:
+        ----------
+            name (str): image file name
+
+        Returns:
+        ----------
+            row (int): row in the arrays, or None if the image is not in the dataset
+        """
+        return self.index.get(normalize_name(name))
+
+    def rows(self, names):
+        """
+        Returns the rows of the first specimen of several images.
+
+        Parameters:
+        ----------
+            names (list): image file names
+
+        Returns:
+        ----------
+            rows (ndarray): rows in the arrays, -1 for images that are not in the dataset
+        """
+        return np.array([self.index.get(normalize_name(n), -1) for n in names], dtype=np.intp)
+
+    def columns(self, part_names):
+        """
+        Returns the columns of coords holding some landmarks.
+
+        Parameters:
+        ----------
+            part_names (list): landmark names
+
+        Returns:
+        ----------
+            columns (ndarray): columns of coords, -1 for landmarks that are not in the dataset
+        """
+        lookup = {name: col for col, name in enumerate(self.part_names.tolist())}
+        return np.array([lookup.get(n, -1) for n in part_names], dtype=np.intp)
+
+
+def _part_key(name):
+    # Landmarks are sorted numerically when all their names are numbers.
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+
+def _grow(array, shape):
+    """
+    Internal function used by load_xml. Returns a copy of a preallocated array padded (with NaN,
+    or -1 for integers) to hold at least the given shape. Axes that are too short are doubled.
+    """
+    shape = [max(2 * n, m) if m > n else n for n, m in zip(array.shape, shape)]
+    grown = np.full(shape, np.nan if array.dtype.kind == "f" else -1, dtype=array.dtype)
+    grown[tuple(slice(0, n) for n in array.shape)] = array
+    return grown
+
+
+def load_xml(xml_file: str):
+    """
+    Loads a dlib format xml file. The file is parsed incrementally and every image element is
+    discarded once read. The coordinates are written straight into preallocated arrays, grown as
+    needed, so memory use only depends on the size of the arrays.
+
+    Parameters:
+    ----------
+        xml_file (str): file to be imported (dlib xml format)
+
+    Returns:
+    ----------
+        dataset (LandmarkDataset): one specimen per box
+    """
+    names = []
+    boxes = np.full((1024, 4), -1, dtype=np.int32)
+    coords = np.full((1024, 8, 2), np.nan, dtype=np.float32)
+    # Landmark name -> column of coords, in order of appearance
+    columns = {}
+    images_e = None
+    image_file = None
+    row = -1
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "images":
+                images_e = elem
+            elif elem.tag == "image":
+                image_file = elem.get("file")
+            elif elem.tag == "box":
+                row = len(names)
+                names.append(image_file)
+                if row >= len(boxes):
+                    boxes = _grow(boxes, (row + 1, 4))
+                    coords = _grow(coords, (row + 1,) + coords.shape[1:])
+                boxes[row] = [
+                    int(float(elem.get(k, -1))) for k in ("top", "left", "width", "height")
+                ]
+            continue
+        if elem.tag == "part":
+            col = columns.setdefault(elem.get("name"), len(columns))
+            if col >= coords.shape[1]:
+                coords = _grow(coords, (len(coords), col + 1, 2))
+            coords[row, col] = (float(elem.get("x")), float(elem.get("y")))
+        elif elem.tag == "image" and images_e is not None:
+            # Drop the parsed image from the tree so that memory use stays flat.
+            images_e.clear()
+
+    # Trimmed copies, so that the spare rows and columns are released
+    part_names = sorted(columns, key=_part_key)
+    coords = coords[: len(names)][:, [columns[name] for name in part_names]]
+    if all(name.isdigit() for name in part_names):
+        part_names = [int(name) for name in part_names]
+    return LandmarkDataset(names, coords, boxes[: len(names)].copy(), np.array(part_names))
+
+
+def load_tps(tps_file: str):
+    """
+    Loads a tps file. Coordinates are kept in the tps coordinate system (y axis pointing up).
+
+    Parameters:
+    ----------
+        tps_file (str): file to be imported (tps format)
+
+    Returns:
+    ----------
+        dataset (LandmarkDataset): one specimen per LM block, with landmarks named by their
+            position in the block
+    """
+    data = tps.read_tps(tps_file)
+    lm = np.array(data["lm"], dtype=np.intp)
+    n_parts = int(lm.max()) if len(lm) else 0
+    coords = np.full((len(lm), n_parts, 2), np.nan, dtype=np.float32)
+    # Scatter the contiguous points into the padded (specimens, parts, 2) array in one step
+    rows = np.repeat(np.arange(len(lm)), lm)
+    cols = np.arange(len(data["points"])) - np.repeat(data["offsets"][:-1], lm)
+    coords[rows, cols] = data["points"]
+    return LandmarkDataset(data["im"], coords)
+
+
+def load_csv(csv_file: str):
+    """
+    Loads a csv file, either written by dlib_xml_to_pandas (id, box_id, box coordinates and
+    X/Y columns) or in the tpsDig XY layout read by read_csv (id followed by X0 Y0 ... Xn Yn).
+
+    Parameters:
+    ----------
+        csv_file (str): file to be imported (csv format)
+
+    Returns:
+    ----------
+        dataset (LandmarkDataset): one specimen per row
+    """
+    with open(csv_file, "r", newline="") as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    names = [row[0] for row in rows]
+    if "box_top" in header:
+        box_cols = [header.index(k) for k in ("box_top", "box_left", "box_width", "box_height")]
+        boxes = np.array([[float(row[c]) for c in box_cols] for row in rows]).reshape(-1, 4)
+        coord_cols = [c for c, name in enumerate(header) if name[:1] in ("X", "Y")]
+        part_names = [int(header[c][1:]) for c in coord_cols[::2]]
+    else:
+        boxes = None
+        coord_cols = list(range(1, len(header)))
+        part_names = None
+    values = np.array(
+        [[float(row[c]) if row[c] != "" else np.nan for c in coord_cols] for row in rows],
+        dtype=np.float32,
+    )
+    return LandmarkDataset(names, values.reshape(len(rows), -1, 2), boxes, part_names)
+
@@ -7,28 +7,47 @@ ap = argparse.ArgumentParser()
 ap.add_argument('-i','--input-dir', type=str, default='images', help="input directory containing image files (default = images)", metavar='')
 ap.add_argument('-c','--csv-file', type=str, default=None, help="(optional) XY coordinate file in csv format", metavar='')
 ap.add_argument('-t','--tps-file', type=str, default=None, help="(optional) tps coordinate file", metavar='')
+ap.add_argument('-m','--manifest', type=str, default=None, help="(optional) manifest file keeping the train/test split of every image. Only new or changed images and xml files are processed on later runs", metavar='')
+ap.add_argument('-w','--workers', type=int, default=8, help="number of images prepared in parallel (default = 8)", metavar='')
 
 
     
 args = vars(ap.parse_args())
 
 assert os.path.isdir(args['input_dir']), "Could not find the folder {}".format(args['input_dir'])
+
+manifest = None
+if args['manifest'] is not None:
+    manifest = utils.load_manifest(args['manifest'], args['input_dir'])
     
-file_sizes=utils.split_train_test(args['input_dir'])
+file_sizes=utils.split_train_test(args['input_dir'], workers=args['workers'],
+                                  assignments=manifest['images'] if manifest is not None else None)
+
+
+def write_split(coords, coordinate_file, split):
+    # In incremental mode the xml and tps files are only rebuilt when the images of the split or the annotations changed
+    if manifest is not None:
+        digest = utils.split_digest(file_sizes[split], coordinate_file)
+        if manifest['outputs'].get(split) == digest and os.path.exists(split + '.xml') and os.path.exists(split + '.tps'):
+            print("{}.xml is up to date".format(split))
+            return
+    utils.generate_dlib_xml(coords,file_sizes[split],folder=split,out_file=split + '.xml')
+    utils.dlib_xml_to_tps(split + '.xml')
+    if manifest is not None:
+        manifest['outputs'][split] = digest
+
 
 if args['csv_file'] is not None:
     dict_csv=utils.read_csv(args['csv_file'])
-    utils.generate_dlib_xml(dict_csv,file_sizes['train'],folder='train',out_file='train.xml')
-    utils.generate_dlib_xml(dict_csv,file_sizes['test'],folder='test',out_file='test.xml')
-    utils.dlib_xml_to_tps('train.xml')
-    utils.dlib_xml_to_tps('test.xml')
+    write_split(dict_csv, args['csv_file'], 'train')
+    write_split(dict_csv, args['csv_file'], 'test')
     
     
     
 if args['tps_file'] is not None:
     dict_tps=utils.read_tps(args['tps_file'])
-    utils.generate_dlib_xml(dict_tps,file_sizes['train'],folder='train',out_file='train.xml')
-    utils.generate_dlib_xml(dict_tps,file_sizes['test'],folder='test',out_file='test.xml')
-    utils.dlib_xml_to_tps('train.xml')
-    utils.dlib_xml_to_tps('test.xml')
-  
+    write_split(dict_tps, args['tps_file'], 'train')
+    write_split(dict_tps, args['tps_file'], 'test')
+
+if manifest is not None:
+    utils.save_manifest(args['manifest'], manifest)
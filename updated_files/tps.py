@@ -0,0 +1,205 @@
+# Part of the standard library
+from itertools import islice
+import json
+import os
+
+# Not part of the standard library
+import numpy as np
+
+
+# Streaming reader and bulk writer for tps landmark files
+
+# Bumped whenever the layout of the binary sidecar files changes
+CACHE_VERSION = 1
+
+
+def read_tps(input, cache=False):
+    '''
+    This function reads a tps coordinate file containing several specimens and an arbitrary number of landmarks.
+    The file is read line by line and the coordinates of every specimen are parsed in one call straight into a
+    single preallocated float array, so large combined files load without building Python lists per landmark.
+    The LM, IMAGE, ID, SCALE and COMMENT fields are supported; CURVES/POINTS blocks are skipped.
+    With cache=True the parsed file is also kept in binary sidecar files (see cache_paths) which are
+    memory mapped on the next call, and rewritten whenever the size or modification time of the
+    tps file changes.
+
+    Parameters:
+        input (str): The tps coordinate file
+        cache (bool): load from and update the binary sidecar files
+    Returns:
+        dict: dictionary containing the keys
+        (lm= number of landmarks, im= image id, id= specimen id, scl= scale, comment= comment,
+        coords= list of (lm, 2) arrays with 2D coordinates, points= (total landmarks, 2) array holding every
+        coordinate, offsets= first row of each specimen in points, followed by the total number of rows).
+        Fields missing from a specimen are None.
+    '''
+    if cache:
+        data = load_cache(input)
+        if data is not None:
+            return data
+        # Taken before parsing, so that a file edited while being read is parsed again next time
+        stamp = _source_stamp(input)
+
+    lm, im, ids, sc, comments = [], [], [], [], []
+    offsets = [0]
+    points = np.empty((4096, 2), dtype=np.float64)
+    total = 0
+
+    with open(input, 'r') as tps_file:
+        lines = iter(tps_file)
+        for ln in lines:
+            ln = ln.strip()
+            if not ln:
+                continue
+            key, _, value = ln.partition('=')
+            key = key.upper()
+
+            if key == 'LM':
+                lm_num = int(value)
+                values = np.fromstring(''.join(islice(lines, lm_num)), dtype=np.float64, sep=' ')
+                if values.size != 2 * lm_num:
+                    raise ValueError('Specimen {} of {} does not have {} landmarks'.format(len(lm) + 1, input, lm_num))
+                if total + lm_num > len(points):
+                    grown = np.empty((max(2 * len(points), total + lm_num), 2), dtype=np.float64)
+                    grown[:total] = points[:total]
+                    points = grown
+                points[total:total + lm_num] = values.reshape(lm_num, 2)
+                total += lm_num
+                offsets.append(total)
+                lm.append(lm_num)
+                im.append(None)
+                ids.append(None)
+                sc.append(None)
+                comments.append(None)
+
+            elif key == 'POINTS':
+                # Curve points are not landmarks
+                for _ in islice(lines, int(value)):
+                    pass
+
+            elif lm:
+                if key == 'IMAGE':
+                    im[-1] = value
+                elif key == 'ID':
+                    ids[-1] = value
+                elif key == 'SCALE':
+                    sc[-1] = float(value)
+                elif key == 'COMMENT':
+                    comments[-1] = value
+
+    data = _to_dict(lm, im, ids, sc, comments, points[:total], np.array(offsets))
+    if cache:
+        save_cache(input, data, stamp)
+    return data
+
+
+def _to_dict(lm, im, ids, sc, comments, points, offsets):
+    """
+    Internal function used by read_tps and load_cache. Builds the dictionary returned by read_tps.
+    """
+    coords_array = [points[offsets[i]:offsets[i + 1]] for i in range(len(lm))]
+    return {'lm': lm, 'im': im, 'id': ids, 'scl': sc, 'comment': comments, 'coords': coords_array,
+            'points': points, 'offsets': offsets}
+
+
+def cache_paths(input):
+    '''
+    Returns the binary sidecar files of a tps file: "<input>.points.npy" holds the (total landmarks, 2)
+    float64 coordinates in a layout that can be memory mapped, and "<input>.meta.npz" holds the
+    landmark counts, offsets, image names, ids, scales and comments together with the size and
+    modification time of the tps file they were built from.
+
+    Parameters:
+        input (str): The tps coordinate file
+    Returns:
+        tuple: (points file, metadata file)
+    '''
+    return input + '.points.npy', input + '.meta.npz'
+
+
+def _source_stamp(input):
+    st = os.stat(input)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_cache(input):
+    '''
+    Loads a tps file from its binary sidecar files. The coordinates are memory mapped read-only.
+
+    Parameters:
+        input (str): The tps coordinate file
+    Returns:
+        dict: same dictionary as read_tps, or None if the sidecar files are missing, unreadable or
+        older than the tps file
+    '''
+    points_file, meta_file = cache_paths(input)
+    try:
+        with np.load(meta_file) as meta:
+            info = json.loads(meta['info'].item())
+            offsets = meta['offsets']
+        if info['version'] != CACHE_VERSION or info['source'] != _source_stamp(input):
+            return None
+        points = np.load(points_file, mmap_mode='r')
+    except (OSError, KeyError, ValueError):
+        return None
+    if points.shape != (offsets[-1], 2):
+        return None
+    return _to_dict(info['lm'], info['im'], info['id'], info['scl'], info['comment'], points, offsets)
+
+
+def save_cache(input, data, stamp=None):
+    '''
+    Writes the binary sidecar files of a tps file. Files are written under a temporary name and then
+    renamed, so an interrupted run never leaves a half written cache. Nothing is written if the folder
+    is read-only.
+
+    Parameters:
+        input (str): The tps coordinate file
+        data (dict): dictionary returned by read_tps for that file
+        stamp (list): (optional) size and modification time of the tps file when it was read
+    Returns:
+        None (files written to disk)
+    '''
+    points_file, meta_file = cache_paths(input)
+    info = {'version': CACHE_VERSION, 'source': stamp or _source_stamp(input), 'lm': list(data['lm']),
+            'im': data['im'], 'id': data['id'], 'scl': data['scl'], 'comment': data['comment']}
+    try:
+        with open(points_file + '.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(data['points'], dtype=np.float64))
+        with open(meta_file + '.tmp', 'wb') as f:
+            np.savez(f, offsets=np.asarray(data['offsets'], dtype=np.int64), info=np.array(json.dumps(info)))
+        # The metadata is renamed last, so the cache only validates once both files are complete
+        os.replace(points_file + '.tmp', points_file)
+        os.replace(meta_file + '.tmp', meta_file)
+    except OSError:
+        pass
+
+
+def write_tps(output, coords, images=None, ids=None, scales=None, comments=None, newline='\n'):
+    '''
+    This function writes specimens to a tps coordinate file. The whole file is formatted in memory and written
+    with a single call. Coordinates are written as Python floats ("260.0 1759.0"), as in the files produced by
+    the other tools.
+
+    Parameters:
+        output (str): The tps coordinate file to be written
+        coords (list): (lm, 2) coordinate array of each specimen
+        images (list): (optional) image file of each specimen
+        ids (list): (optional) id of each specimen
+        scales (list): (optional) scale of each specimen
+        comments (list): (optional) comment of each specimen
+        newline (str): line terminator
+    Returns:
+        None (file written to disk)
+    '''
+    lines = []
+    for i, specimen in enumerate(coords):
+        specimen = np.asarray(specimen, dtype=np.float64)
+        lines.append('LM={}'.format(len(specimen)))
+        lines.extend('{} {}'.format(x, y) for x, y in specimen.tolist())
+        for key, values in (('IMAGE', images), ('ID', ids), ('SCALE', scales), ('COMMENT', comments)):
+            if values is not None and values[i] is not None:
+                lines.append('{}={}'.format(key, values[i]))
+
+    with open(output, 'w', newline='') as f:
+        f.write(newline.join(lines) + (newline if lines else ''))
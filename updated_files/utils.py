@@ -2,19 +2,36 @@
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import csv
+import io
 import re
 import glob
 import ntpath
+from itertools import chain
+import hashlib
+import json
+import pickle
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 
 # Not part of the standard library
 import numpy as np
 import pandas as pd
 import cv2
+from PIL import Image
 import dlib
+import landmarks
+import tps
 import os
 import shutil
 import random
 
+# Optional: DICOM images are only predicted when pydicom is installed
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
 
 # Tools for predicting objects and shapes in new images
 
@@ -40,23 +57,30 @@ def initialize_xml():
     return root, images_e
 
 
-def create_box(img_shape):
+def create_box(img_shape, rect=None):
     """
-    Creates a box around the image
+    Creates a box around the image, or around a detected object
 
     Parameters:
     ----------
         img_shape (tuple): shape of the image
+        rect (tuple): (optional) (left, top, right, bottom) of a detected object
 
     Returns:
     ----------
         box (Element): box element
     """
     box = ET.Element("box")
-    box.set("top", str(int(1)))
-    box.set("left", str(int(1)))
-    box.set("width", str(int(img_shape[1] - 2)))
-    box.set("height", str(int(img_shape[0] - 2)))
+    if rect is None:
+        box.set("top", str(int(1)))
+        box.set("left", str(int(1)))
+        box.set("width", str(int(img_shape[1] - 2)))
+        box.set("height", str(int(img_shape[0] - 2)))
+    else:
+        box.set("top", str(int(rect[1])))
+        box.set("left", str(int(rect[0])))
+        box.set("width", str(int(rect[2] - rect[0])))
+        box.set("height", str(int(rect[3] - rect[1])))
 
     return box
 
@@ -67,8 +91,8 @@ def create_part(x, y, id):
 
     Parameters:
     ----------
-        x (int): x coordinate of the part
-        y (int): y coordinate of the part
+        x (float): x coordinate of the part
+        y (float): y coordinate of the part
         name (str): name of the part
 
     Returns:
@@ -77,8 +101,9 @@ def create_part(x, y, id):
     """
     part = ET.Element("part")
     part.set("name", str(int(id)))
-    part.set("x", str(int(x)))
-    part.set("y", str(int(y)))
+    # dlib reads integer coordinates, so round the sub-pixel positions rather than truncate them
+    part.set("x", str(int(round(x))))
+    part.set("y", str(int(round(y))))
 
     return part
 
@@ -102,92 +127,859 @@ def pretty_xml(elem, out):
         f.write(xmlstr)
 
 
+# Per-process state used by the inference workers. The models are loaded once per worker by
+# _init_worker rather than once per image.
+_predictor = None
+_detector = None
+_options = {}
+
+
+def _init_worker(predictor_name: str, options=None, pool=False):
+    """
+    Internal function used by predictions_to_xml. Loads the shape predictor (and the optional
+    object detector) into the current process so that they are shared by every image handled by
+    this worker.
+
+    Parameters:
+    ----------
+        predictor_name (str): shape predictor filename
+        options (dict): (optional) inference options, see predictions_to_xml
+        pool (bool): True in the worker processes of a pool
+
+    Returns:
+    ----------
+        None
+    """
+    global _predictor, _detector, _options
+    if pool:
+        # One image per core already saturates the machine, so keep OpenCV from spawning its
+        # own threads inside every worker. A single process keeps them for the filters.
+        cv2.setNumThreads(1)
+    _options = dict(options or {})
+    _predictor = dlib.shape_predictor(predictor_name)
+    _detector = None
+    if _options.get("detector") is not None:
+        # fhog_object_detector loads the same file as simple_object_detector, but its run
+        # method also returns the detection scores.
+        _detector = dlib.fhog_object_detector(_options["detector"])
+
+
+def filter_image(img, blur_kernel=7, bilateral=(9, 41, 21), scale=1):
+    """
+    Internal function used by build_pyramid. Smooths an image with a box filter followed by a
+    bilateral filter. The filter sizes are given for full resolution images and are shrunk with
+    the scale of the image.
+
+    Parameters:
+    ----------
+        img (array): image
+        blur_kernel (int): size of the box filter, 0 disables the filter
+        bilateral (tuple): (diameter, sigma color, sigma space) of the bilateral filter, a
+            diameter of 0 disables the filter
+        scale (float): scale of the image relative to full resolution
+
+    Returns:
+    ----------
+        img (array): filtered image
+    """
+    if blur_kernel > 0:
+        # Keep the kernel odd so that it stays centred on the pixel.
+        k = max(1, int(blur_kernel * scale)) | 1
+        img = cv2.filter2D(img, -1, np.ones((k, k), np.float32) / (k * k))
+    d, sigma_color, sigma_space = bilateral
+    if d > 0:
+        img = cv2.bilateralFilter(
+            img, max(1, int(round(d * scale))), sigma_color, sigma_space * scale
+        )
+    return img
+
+
+def build_pyramid(img, scales, blur_kernel=7, bilateral=(9, 41, 21), per_level=False):
+    """
+    Internal function used by predict_image. Builds the resized (and filtered) images used for
+    multi-scale prediction. Every level is resized from the previous, larger one rather than
+    from the full resolution image.
+
+    By default only the largest level is filtered and the smaller levels are downsampled from
+    it, so the full resolution image is never filtered unless a scale of 1 is requested. With
+    per_level, every level is filtered separately with filter sizes adapted to its scale.
+
+    Parameters:
+    ----------
+        img (array): full resolution image
+        scales (list): scaling factors of the levels
+        blur_kernel (int): size of the box filter at full resolution, 0 disables the filter
+        bilateral (tuple): (diameter, sigma color, sigma space) of the bilateral filter at full
+            resolution, a diameter of 0 disables the filter
+        per_level (bool): filter every level instead of only the largest one
+
+    Returns:
+    ----------
+        pyramid (dict): images keyed by their scaling factor
+    """
+    h, w = img.shape[:2]
+    pyramid = {}
+    previous = img
+    for i, scale in enumerate(sorted(set(scales), reverse=True)):
+        # Same output size as cv2.resize(img, (0, 0), fx=scale, fy=scale). The previous level
+        # may be larger than the full resolution image (scales above 1), so the size is compared
+        # rather than the scale.
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        if size != (previous.shape[1], previous.shape[0]):
+            shrink = size[0] < previous.shape[1]
+            interpolation = cv2.INTER_AREA if shrink else cv2.INTER_LINEAR
+            previous = cv2.resize(previous, size, interpolation=interpolation)
+        if per_level:
+            pyramid[scale] = filter_image(previous, blur_kernel, bilateral, scale)
+        else:
+            if i == 0:
+                # Filtering the largest level and resizing the filtered image keeps the
+                # behaviour of filtering once before resizing.
+                previous = filter_image(previous, blur_kernel, bilateral, scale)
+            pyramid[scale] = previous
+    return pyramid
+
+
+def read_dicom(f: str):
+    """
+    Internal function used by read_image. Reads a DICOM image straight into an 8-bit grey image,
+    without a jpg intermediate. The rescale slope/intercept and the first VOI window of the file
+    (or, without a window, the range of the pixel values) are mapped to 0-255 in a single pass,
+    without floating point copies of the pixel data.
+
+    Parameters:
+    ----------
+        f (str): path to the DICOM file
+
+    Returns:
+    ----------
+        img (array): 8-bit grey image
+    """
+    if pydicom is None:
+        raise ImportError("pydicom is required to read DICOM files")
+    ds = pydicom.dcmread(f)
+    img = ds.pixel_array
+    if img.ndim == 3 and ds.get("SamplesPerPixel", 1) == 1:
+        # Only the first frame of multi-frame files is used
+        img = img[0]
+    if img.ndim == 3:
+        return cv2.cvtColor(img.astype(np.uint8), cv2.COLOR_RGB2GRAY)
+
+    if "WindowCenter" in ds and "WindowWidth" in ds:
+        slope = float(ds.get("RescaleSlope", 1))
+        intercept = float(ds.get("RescaleIntercept", 0))
+        center = float(np.ravel(np.asarray(ds.WindowCenter, dtype=float))[0])
+        width = float(np.ravel(np.asarray(ds.WindowWidth, dtype=float))[0])
+        low = center - 0.5 - (width - 1) / 2
+        # out = (value * slope + intercept - low) * 255 / (width - 1), saturated to 0-255
+        alpha = 255.0 / max(width - 1, 1)
+        img = cv2.addWeighted(img, slope * alpha, img, 0, (intercept - low) * alpha, dtype=cv2.CV_8U)
+    else:
+        img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    if ds.get("PhotometricInterpretation") == "MONOCHROME1":
+        # Low values are white in MONOCHROME1
+        cv2.bitwise_not(img, dst=img)
+    return img
+
+
+def read_image(f: str, grayscale=False):
+    """
+    Internal function used by predict_image. Reads an image file, or a DICOM file when pydicom
+    is installed.
+
+    Parameters:
+    ----------
+        f (str): path to the image file
+        grayscale (bool): read the image as a single channel
+
+    Returns:
+    ----------
+        img (array): grey or BGR image
+    """
+    if ntpath.splitext(f)[1].lower() == ".dcm":
+        img = read_dicom(f)
+        return img if grayscale else cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return cv2.imread(f, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+
+
+def detect_box(img, scale=0.25):
+    """
+    Internal function used by predict_image. Runs the object detector on a downscaled copy of
+    the image and returns the highest scoring detection in full resolution coordinates.
+
+    Parameters:
+    ----------
+        img (array): image
+        scale (float): scaling factor applied to the image before detection
+
+    Returns:
+    ----------
+        box (tuple): (left, top, right, bottom) of the detected object, or None if nothing
+            was detected
+    """
+    small = cv2.resize(img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    rects, scores, _ = _detector.run(small, upsample_num_times=0, adjust_threshold=0.0)
+    if len(rects) == 0:
+        return None
+
+    rect = rects[int(np.argmax(scores))]
+    h, w = img.shape[:2]
+    left = min(max(int(rect.left() / scale), 0), w - 1)
+    top = min(max(int(rect.top() / scale), 0), h - 1)
+    right = min(max(int(rect.right() / scale), left + 1), w - 1)
+    bottom = min(max(int(rect.bottom() / scale), top + 1), h - 1)
+    return left, top, right, bottom
+
+
+def predict_image(f: str):
+    """
+    Internal function used by predictions_to_xml. Reads and filters a single image, predicts its
+    landmarks at several scales and aggregates them. When a detector was loaded, the filters and
+    the shape predictor only run on the detected region. Must be called from a process
+    initialized with _init_worker.
+
+    Parameters:
+    ----------
+        f (str): path to the image file
+
+    Returns:
+    ----------
+        record (dict): image file, image shape, box, median landmark coordinates, per landmark
+            spread across scales and variance error (sum of the spreads)
+    """
+    scales = _options.get("scales", [0.25, 0.5, 1])
+    print(f"Processing image {f}")
+    grayscale = _options.get("grayscale", False)
+    img = read_image(f, grayscale)
+    h, w = img.shape[:2]
+    # The detected box is (left, top, right, bottom) in image coordinates. The predictor always
+    # gets the full frame of the image it runs on, as in training (generate_dlib_xml only writes
+    # full-frame boxes): the whole image, or the padded crop around the detection.
+    box = None
+    x0, y0 = 0, 0
+    if _detector is not None:
+        box = detect_box(img, _options.get("detector_scale", 0.25))
+        if box is not None:
+            # Crop around the detection with some padding so that the filters have context.
+            pad_x = int((box[2] - box[0]) * _options.get("detector_padding", 0.1))
+            pad_y = int((box[3] - box[1]) * _options.get("detector_padding", 0.1))
+            x0, y0 = max(box[0] - pad_x, 0), max(box[1] - pad_y, 0)
+            x1, y1 = min(box[2] + pad_x, w), min(box[3] + pad_y, h)
+            img = img[y0:y1, x0:x1]
+
+    if not grayscale:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    pyramid = build_pyramid(
+        img,
+        scales,
+        blur_kernel=_options.get("blur_kernel", 7),
+        bilateral=_options.get("bilateral", (9, 41, 21)),
+        per_level=_options.get("filter_per_level", False),
+    )
+    predictions = []
+    crop_h, crop_w = img.shape[:2]
+    for scale in scales:
+        image = pyramid[scale]
+        rect = dlib.rectangle(1, 1, int(crop_w * scale) - 1, int(crop_h * scale) - 1)
+        shape = _predictor(image, rect)
+        predictions.append(shape_to_np(shape) / scale + (x0, y0))
+
+    # (scales, parts, 2): the median gives the landmark positions, and the mean distance of each
+    # scale's prediction to the mean prediction measures how much the scales disagree.
+    predictions = np.stack(predictions)
+    parts = np.median(predictions, axis=0)
+    distances = np.linalg.norm(predictions - predictions.mean(axis=0), axis=2)
+    spread = distances.mean(axis=0)
+    error = float(spread.sum())
+
+    return {
+        "file": f,
+        "shape": (h, w),
+        "box": box,
+        "parts": parts,
+        "spread": spread,
+        "error": error,
+    }
+
+
 def predictions_to_xml(
-    predictor_name: str, folder: str, ignore=None, output="output.xml"):
+    predictor_name: str,
+    folder: str,
+    ignore=None,
+    output="output.xml",
+    workers=1,
+    detector_name=None,
+    detector_scale=0.25,
+    detector_padding=0.1,
+    scales=(0.25, 0.5, 1),
+    blur_kernel=7,
+    bilateral=(9, 41, 21),
+    filter_per_level=False,
+    cache=None,
+    formats=("xml",),
+    grayscale=False,
+):
     """
     Generates dlib format xml files for model predictions. It uses previously trained models to
-    identify objects in images and to predict their shape.
+    identify objects in images and to predict their shape. Images can be spread over a pool of
+    worker processes; the output does not depend on the number of workers.
 
     Parameters:
     ----------
         predictor_name (str): shape predictor filename
-        dir(str): name of the directory containing images to be predicted
-        ratio (float): (optional) scaling factor for the image
-        out_file (str): name of the output file (xml format)
-        variance_threshold (float): threshold value to determine high variance images
+        folder (str): name of the directory containing images to be predicted. DICOM files
+            are read directly when pydicom is installed
+        ignore (list): (optional) landmarks that should not be written to the output
+        output (str): name of the output file (xml format)
+        workers (int): number of worker processes used for prediction (default = 1)
+        detector_name (str): (optional) object detector filename. If given, landmarks are only
+            predicted inside the highest scoring detection of each image
+        detector_scale (float): scaling factor applied to the images before detection
+        detector_padding (float): padding around the detection that is kept when cropping, as a
+            fraction of the detection size
+        scales (list): scaling factors at which the landmarks are predicted
+        blur_kernel (int): size of the box filter at full resolution, 0 disables the filter
+        bilateral (tuple): (diameter, sigma color, sigma space) of the bilateral filter at full
+            resolution, a diameter of 0 disables the filter
+        filter_per_level (bool): filter every scale separately instead of filtering the
+            largest one and downsampling it
+        cache (str): (optional) sqlite file where the predictions are stored as they are made.
+            Images whose content, models and options match a stored prediction are not
+            predicted again, so an interrupted run can be resumed
+        formats (list): output formats written in the same pass, any of 'xml', 'csv', 'tps'
+            and 'parquet'. The csv, tps and parquet files are named after output
+        grayscale (bool): read and filter the images as a single channel, which dlib accepts
+            as well. Faster and lighter for x-rays, which carry no colour
 
     Returns:
     ----------
-        None (out_file written to disk)
+        None (output files written to disk)
     """
     extensions = {".jpg", ".jpeg", ".tif", ".png", ".bmp"}
-    scales = [0.25, 0.5, 1]
+    if pydicom is not None:
+        extensions.add(".dcm")
     files = glob.glob(f"./{folder}/*")
+    files = [f for f in sorted(files, key=str) if ntpath.splitext(f)[1].lower() in extensions]
+
+    options = {
+        "detector": detector_name,
+        "detector_scale": detector_scale,
+        "detector_padding": detector_padding,
+        "scales": list(scales),
+        "blur_kernel": blur_kernel,
+        "bilateral": tuple(bilateral),
+        "filter_per_level": filter_per_level,
+        "grayscale": grayscale,
+    }
+
+    if cache is None:
+        records = predict_images(predictor_name, files, workers, options)
+    else:
+        records = cached_predict_images(predictor_name, files, workers, options, cache)
 
-    predictor = dlib.shape_predictor(predictor_name)
-
-    root, images_e = initialize_xml()
-
-    kernel = np.ones((7, 7), np.float32) / 49
-
-
-    for f in sorted(files, key=str):
-        error = 0
-        ext = ntpath.splitext(f)[1]
-        if ext.lower() in extensions:
-            print(f"Processing image {f}")
-            image_e = ET.Element("image")
-            image_e.set("file", str(f))
-            img = cv2.imread(f)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img = cv2.filter2D(img, -1, kernel)
-            img =  cv2.bilateralFilter(img, 9, 41, 21)
-            w = img.shape[1]
-            h = img.shape[0]
-            landmarks = []
-            for scale in scales:
-                image = cv2.resize(img, (0, 0), fx=scale, fy=scale)
-                rect = dlib.rectangle(1, 1, int(w * scale) - 1, int(h * scale) - 1)
-                shape = predictor(image, rect)
-                landmarks.append(shape_to_np(shape) / scale)
-
-            box = create_box(img.shape)
-            part_length = range(0, shape.num_parts)
-            
-            for item, i in enumerate(sorted(part_length, key=str)):
-                x = np.median([landmark[item][0] for landmark in landmarks])
-                y = np.median([landmark[item][1] for landmark in landmarks])
-                if ignore is not None:
-                    if i not in ignore:
-                        part = create_part(x, y, i)
-                        box.append(part)
-                else:
-                    part = create_part(x, y, i)
-                    box.append(part)
-
-                pos = np.array(landmarks)[:, item]
-                pos_x, pos_y = (
-                    pos[:, 0],
-                    pos[:, 1],
-                )
-
-                mean_x, mean_y = np.mean(pos_x), np.mean(pos_y)
-                distances = np.sqrt((pos_x - mean_x) ** 2 + (pos_y - mean_y) ** 2)
-                total_variance = np.mean(distances)
-                error += total_variance
-                
-
-
-            box[:] = sorted(box, key=lambda child: (child.tag, float(child.get("name"))))
-            image_e.append(box)
-            image_e.set("error", str(error))
-            images_e.append(image_e)
-        
-    images_e[:] = sorted(
-            images_e, key=lambda child: (child.tag, float(child.get("error"))), reverse=True
+    with ExitStack() as stack:
+        writers = [stack.enter_context(w) for w in create_writers(output, formats, ignore)]
+        for record in records:
+            for writer in writers:
+                writer.write(record)
+
+
+def cached_predict_images(predictor_name: str, files, workers, options, cache_file):
+    """
+    Internal function used by predictions_to_xml. Same as predict_images, but records are looked
+    up in and added to a ResultCache, so that only new or modified images are predicted.
+
+    Parameters:
+    ----------
+        predictor_name (str): shape predictor filename
+        files (list): paths to the image files
+        workers (int): number of worker processes used for prediction
+        options (dict): inference options, see predictions_to_xml
+        cache_file (str): sqlite file holding the cached predictions
+
+    Returns:
+    ----------
+        records (generator): prediction records, in the same order as files
+    """
+    # The models are identified by their content, so moving or renaming them keeps the cache.
+    models = [predictor_name] + ([options["detector"]] if options.get("detector") else [])
+    settings = dict(options, detector=None)
+    key = hashlib.sha1(
+        json.dumps([file_hash(m) for m in models] + [settings], sort_keys=True).encode()
+    ).hexdigest()
+
+    with ResultCache(cache_file, key) as results:
+        hashes = [results.image_hash(f) for f in files]
+        cached = [results.get(h) for h in hashes]
+        missing = [f for f, record in zip(files, cached) if record is None]
+        print(f"{len(files) - len(missing)} of {len(files)} images found in {cache_file}")
+
+        predicted = predict_images(predictor_name, missing, workers, options)
+        for f, h, record in zip(files, hashes, cached):
+            if record is None:
+                record = next(predicted)
+                results.put(h, record)
+            else:
+                # The same image may have been predicted under another name.
+                record["file"] = f
+            yield record
+        predicted.close()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Computes the sha1 digest of a file's content.
+
+    Parameters:
+    ----------
+        path (str): file path
+        chunk_size (int): number of bytes read at a time
+
+    Returns:
+    ----------
+        digest (str): hexadecimal sha1 digest
+    """
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ResultCache:
+    """
+    Local sqlite store of prediction records. Records are keyed on the sha1 of the image content
+    and on a key describing the models and inference options, so changing either invalidates
+    them. Every record is committed as soon as it is added.
+
+    Image hashes are remembered together with the file size and modification time, so unchanged
+    files are not read again on later runs.
+
+    Parameters:
+    ----------
+        path (str): sqlite file
+        key (str): models and options key the records are stored under
+    """
+
+    def __init__(self, path, key):
+        self.key = key
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records "
+            "(image_hash TEXT, key TEXT, record BLOB, PRIMARY KEY (image_hash, key))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, image_hash TEXT)"
+        )
+        self.db.commit()
+
+    def image_hash(self, path):
+        """
+        Returns the content hash of an image, reusing the stored one if the file is unchanged.
+
+        Parameters:
+        ----------
+            path (str): image file
+
+        Returns:
+        ----------
+            digest (str): hexadecimal sha1 digest
+        """
+        stat = os.stat(path)
+        row = self.db.execute(
+            "SELECT image_hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (os.path.abspath(path), stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = file_hash(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, digest),
+        )
+        self.db.commit()
+        return digest
+
+    def get(self, image_hash):
+        """
+        Returns the stored record of an image, or None if it was not predicted yet.
+
+        Parameters:
+        ----------
+            image_hash (str): content hash of the image
+
+        Returns:
+        ----------
+            record (dict): prediction record
+        """
+        row = self.db.execute(
+            "SELECT record FROM records WHERE image_hash = ? AND key = ?", (image_hash, self.key)
+        ).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, image_hash, record):
+        """
+        Stores the record of an image.
+
+        Parameters:
+        ----------
+            image_hash (str): content hash of the image
+            record (dict): prediction record
+
+        Returns:
+        ----------
+            None
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+            (image_hash, self.key, pickle.dumps(record)),
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def predict_images(predictor_name: str, files, workers=1, options=None):
+    """
+    Internal function used by predictions_to_xml. Predicts the landmarks of a list of images,
+    either in the current process or spread over a pool of worker processes.
+
+    Parameters:
+    ----------
+        predictor_name (str): shape predictor filename
+        files (list): paths to the image files
+        workers (int): number of worker processes used for prediction (default = 1)
+        options (dict): (optional) inference options, see predictions_to_xml
+
+    Returns:
+    ----------
+        records (generator): prediction records, in the same order as files
+    """
+    if workers > 1:
+        # Executor.map yields results in submission order, so the xml is the same as for a
+        # single process. Chunking keeps the inter-process overhead low for large batches.
+        chunksize = max(1, len(files) // (workers * 4))
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(predictor_name, options, True)
+        ) as executor:
+            yield from executor.map(predict_image, files, chunksize=chunksize)
+    else:
+        _init_worker(predictor_name, options)
+        for f in files:
+            yield predict_image(f)
+
+
+def record_to_element(record, ignore=None):
+    """
+    Internal function used by predictions_to_xml. Converts a prediction record into an 'image'
+    xml element.
+
+    Parameters:
+    ----------
+        record (dict): prediction record returned by predict_image
+        ignore (list): (optional) landmarks that should not be written to the output
+
+    Returns:
+    ----------
+        image_e (Element): image element
+    """
+    image_e = ET.Element("image")
+    image_e.set("file", str(record["file"]))
+    box = create_box(record["shape"], record.get("box"))
+    if record.get("box") is not None:
+        # The box no longer spans the image, so keep the image size for dlib_xml_to_tps.
+        image_e.set("width", str(int(record["shape"][1])))
+        image_e.set("height", str(int(record["shape"][0])))
+    # dlib stores the training parts ordered by their names as strings, so the predictor's
+    # part index i corresponds to the i-th name in that order. order lists the part indices by
+    # increasing name.
+    names = np.array(sorted(range(0, len(record["parts"])), key=str))
+    order = np.argsort(names)
+    parts = record["parts"][order]
+    spread = record["spread"][order]
+    for i in range(len(order)):
+        if ignore is None or i not in ignore:
+            part = create_part(parts[i, 0], parts[i, 1], i)
+            part.set("spread", f"{spread[i]:.2f}")
+            box.append(part)
+
+    image_e.append(box)
+    image_e.set("error", str(record["error"]))
+
+    return image_e
+
+
+def element_to_xml(elem, depth=0):
+    """
+    Internal function used by XMLWriter. Serializes an xml element using the same layout as
+    minidom's toprettyxml, so that streamed files are identical to the ones written by pretty_xml.
+
+    Parameters:
+    ----------
+        elem (Element): element to be serialized
+        depth (int): indentation level of the element
+
+    Returns:
+    ----------
+        xmlstr (str): serialized element
+    """
+    pad = "   " * depth
+    attrs = "".join(
+        ' {}="{}"'.format(
+            k,
+            v.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;").replace(">", "&gt;"),
+        )
+        for k, v in elem.attrib.items()
     )
+    if len(elem) == 0:
+        return f"{pad}<{elem.tag}{attrs}/>\n"
+    children = "".join(element_to_xml(child, depth + 1) for child in elem)
+    return f"{pad}<{elem.tag}{attrs}>\n{children}{pad}</{elem.tag}>\n"
+
+
+class PredictionWriter:
+    """
+    Base class of the prediction output writers. Every record is rendered and appended to a
+    temporary '.part' file as soon as it is written, so memory use does not grow with the number
+    of images and an interrupted run leaves the rendered records on disk. When the writer is
+    closed, the records are copied to the output file, sorted by decreasing error as in the
+    prediction xml, in a second pass that reads one record at a time.
+
+    Subclasses implement render, and optionally header and footer.
+
+    Parameters:
+    ----------
+        output (str): name of the output file
+        ignore (list): (optional) landmarks that should not be written to the output
+        sort (bool): sort the records by decreasing error (default = True)
+    """
+
+    def __init__(self, output, ignore=None, sort=True):
+        self.output = output
+        self.ignore = ignore
+        self.sort = sort
+        self.part_file = f"{output}.part"
+        self._f = open(self.part_file, "wb")
+        # (error, offset, length) of every record in the '.part' file
+        self._index = []
+
+    def render(self, image_e):
+        raise NotImplementedError
+
+    def header(self):
+        return ""
+
+    def footer(self):
+        return ""
+
+    def write(self, record):
+        """
+        Appends a prediction record to the output.
+
+        Parameters:
+        ----------
+            record (dict): prediction record returned by predict_image
+
+        Returns:
+        ----------
+            None
+        """
+        # All the formats are rendered from the xml element, so that they hold exactly the
+        # values written to the prediction xml.
+        data = self.render(record_to_element(record, self.ignore)).encode("utf-8")
+        offset = self._f.tell()
+        self._f.write(data)
+        self._f.flush()
+        self._index.append((float(record["error"]), offset, len(data)))
+
+    def records(self):
+        """
+        Internal method used by close. Reads back the rendered records, in output order.
+
+        Returns:
+        ----------
+            records (generator): rendered records (bytes)
+        """
+        index = self._index
+        if self.sort:
+            index = sorted(index, key=lambda entry: entry[0], reverse=True)
+        with open(self.part_file, "rb") as part:
+            for _, offset, length in index:
+                part.seek(offset)
+                yield part.read(length)
+
+    def close(self):
+        """
+        Writes the final output file and removes the temporary '.part' file.
+
+        Returns:
+        ----------
+            None (file written to disk)
+        """
+        self._f.close()
+        with open(self.output, "wb") as f:
+            f.write(self.header().encode("utf-8"))
+            for data in self.records():
+                f.write(data)
+            f.write(self.footer().encode("utf-8"))
+        os.remove(self.part_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the '.part' file so that the records written so far are not lost.
+            self._f.close()
+
+
+class XMLWriter(PredictionWriter):
+    """
+    Writes dlib format xml files incrementally. The layout is the one produced by pretty_xml.
+    """
+
+    def render(self, image_e):
+        return element_to_xml(image_e, depth=2)
+
+    def header(self):
+        xmlstr = '<?xml version="1.0" ?>\n<dataset>\n   <name/>\n   <comment/>\n'
+        return xmlstr + ("   <images>\n" if self._index else "   <images/>\n")
+
+    def footer(self):
+        return ("   </images>\n" if self._index else "") + "</dataset>\n"
+
+
+class CSVWriter(PredictionWriter):
+    """
+    Writes predictions in the csv format produced by dlib_xml_to_pandas: one row per box with
+    the image file, box id, box coordinates and the X/Y coordinates of every landmark.
+    """
+
+    columns = None
+
+    def render(self, image_e):
+        rows = []
+        for box in image_e:
+            row = [
+                image_e.get("file"),
+                "_".join(box.get(k) for k in ("top", "left", "width", "height")),
+            ]
+            row += [float(box.get(k)) for k in ("top", "left", "width", "height")]
+            for part in box:
+                row += [float(part.get("x")), float(part.get("y"))]
+            rows.append(row)
+            if self.columns is None:
+                self.columns = ["id", "box_id", "box_top", "box_left", "box_width", "box_height"]
+                for part in box:
+                    self.columns += ["X" + part.get("name"), "Y" + part.get("name")]
+        out = io.StringIO()
+        csv.writer(out, lineterminator="\n").writerows(rows)
+        return out.getvalue()
+
+    def header(self):
+        out = io.StringIO()
+        csv.writer(out, lineterminator="\n").writerow(self.columns or ["id", "box_id"])
+        return out.getvalue()
+
+
+class TPSWriter(PredictionWriter):
+    """
+    Writes predictions in the tps format produced by dlib_xml_to_tps. Specimen IDs are numbered
+    in output order.
+    """
+
+    def render(self, image_e):
+        specimens = []
+        for boxes in image_e:
+            if "height" in image_e.attrib:
+                height = float(image_e.get("height"))
+            else:
+                height = float(boxes.get("height")) + 2
+            out = io.StringIO()
+            wr = csv.writer(out, delimiter=" ")
+            wr.writerows([["LM=" + str(int(len(boxes)))]])
+            wr.writerows(
+                [[float(part.get("x")), height - float(part.get("y"))] for part in boxes]
+            )
+            wr.writerows([["IMAGE=" + image_e.get("file")]])
+            specimens.append(out.getvalue())
+        # One specimen per box, separated by a character that cannot appear in the text.
+        return "\0".join(specimens)
+
+    def records(self):
+        # IDs depend on the output order, so they are added while copying.
+        id = 0
+        for data in super().records():
+            for specimen in data.split(b"\0"):
+                out = io.StringIO()
+                csv.writer(out, delimiter=" ").writerows([["ID=" + str(int(id))]])
+                yield specimen + out.getvalue().encode("utf-8")
+                id += 1
+
+
+class ParquetWriter(CSVWriter):
+    """
+    Writes predictions as a parquet table with the columns of the csv format. Requires pandas'
+    optional pyarrow (or fastparquet) dependency. Rows are compact, so the table is only
+    assembled when the writer is closed.
+    """
+
+    def __init__(self, output, ignore=None, sort=True):
+        # Fail before any image is predicted if no parquet engine is installed.
+        pd.io.parquet.get_engine("auto")
+        super().__init__(output, ignore=ignore, sort=sort)
+
+    def close(self):
+        self._f.close()
+        rows = list(csv.reader(io.StringIO(b"".join(self.records()).decode("utf-8"))))
+        # Like the csv header, an empty run only has the id columns
+        df = pd.DataFrame(rows, columns=self.columns or ["id", "box_id"])
+        df[df.columns[2:]] = df[df.columns[2:]].astype(float)
+        df.set_index(["id", "box_id"]).to_parquet(self.output)
+        os.remove(self.part_file)
+
+
+def create_writers(output, formats=("xml",), ignore=None):
+    """
+    Creates the prediction writers for a list of output formats. The csv, tps and parquet files
+    are named after the xml output file.
+
+    Parameters:
+    ----------
+        output (str): name of the xml output file
+        formats (list): output formats, any of 'xml', 'csv', 'tps' and 'parquet'
+        ignore (list): (optional) landmarks that should not be written to the output
 
-    pretty_xml(root, output)
+    Returns:
+    ----------
+        writers (list): PredictionWriter objects
+    """
+    writer_types = {
+        "xml": XMLWriter,
+        "csv": CSVWriter,
+        "tps": TPSWriter,
+        "parquet": ParquetWriter,
+    }
+    if "parquet" in formats:
+        # Checked before any '.part' file is opened, so that a missing engine leaves nothing behind
+        pd.io.parquet.get_engine("auto")
+    basename = ntpath.splitext(output)[0]
+    writers = []
+    for fmt in formats:
+        name = output if fmt == "xml" else f"{basename}.{fmt}"
+        writers.append(writer_types[fmt](name, ignore=ignore))
+    return writers
 
 
 def shape_to_np(shape):
@@ -202,18 +994,17 @@ def shape_to_np(shape):
     Returns
     -------
     coords: np.ndarray
-        A NumPy array of (x, y)-coordinates representing the landmarks in the input shape object.
+        A float NumPy array of (x, y)-coordinates representing the landmarks in the input shape
+        object, in part index order.
     """
-    # initialize the list of (x, y)-coordinates
-    coords = np.zeros((shape.num_parts, 2), dtype="int")
-
-    length = range(0, shape.num_parts)
-
-    for i in sorted(length, key=str):
-        coords[i] = [shape.part(i).x, shape.part(i).y]
+    # parts() fetches every landmark in one call; fromiter then fills the float array directly
+    # instead of going through shape.part(i) and a temporary list per landmark.
+    parts = shape.parts()
+    coords = np.fromiter(
+        chain.from_iterable((p.x, p.y) for p in parts), dtype=np.float64, count=2 * len(parts)
+    )
 
-    # return the list of (x, y)-coordinates
-    return coords
+    return coords.reshape(-1, 2)
 
 
 # Importing to pandas tools
@@ -237,53 +1028,44 @@ def natural_sort(l):
     return sorted(l, key=alphanum_key)
 
 
-def dlib_xml_to_pandas(xml_file: str, parse=False):
+def dlib_xml_to_pandas(xml_file: str, parse=False, write_csv=True):
     """
     Imports dlib xml data into a pandas dataframe. An optional file parsing argument is present
     for very specific applications. For most people, the parsing argument should remain as 'False'.
 
+    The file is read incrementally (see landmarks.load_xml) and the one-row-per-box dataframe is
+    built directly from the coordinate arrays.
+
     Parameters:
     ----------
         xml_file(str):file to be imported (dlib xml format)
+        write_csv(bool): also write the dataframe to a csv file named after xml_file
+            (default = True)
 
     Returns:
     ----------
         df(dataframe): returns a pandas dataframe containing the data in the xml_file.
     """
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    landmark_list = []
-    for images in root:
-        for image in images:
-            for boxes in image:
-                box = (
-                    boxes.attrib["top"]
-                    + "_"
-                    + boxes.attrib["left"]
-                    + "_"
-                    + boxes.attrib["width"]
-                    + "_"
-                    + boxes.attrib["height"]
-                )
-                for parts in boxes:
-                    if parts.attrib["name"] is not None:
-                        data = {
-                            "id": image.attrib["file"],
-                            "box_id": box,
-                            "box_top": float(boxes.attrib["top"]),
-                            "box_left": float(boxes.attrib["left"]),
-                            "box_width": float(boxes.attrib["width"]),
-                            "box_height": float(boxes.attrib["height"]),
-                            "X" + parts.attrib["name"]: float(parts.attrib["x"]),
-                            "Y" + parts.attrib["name"]: float(parts.attrib["y"]),
-                        }
-
-                    landmark_list.append(data)
-    dataset = pd.DataFrame(landmark_list)
-    df = dataset.groupby(["id", "box_id"], sort=False).max()
-    df = df[natural_sort(df)]
-    basename = ntpath.splitext(xml_file)[0]
-    df.to_csv(f"{basename}.csv")
+    dataset = landmarks.load_xml(xml_file)
+    box_id = ["_".join(str(v) for v in box) for box in dataset.boxes.tolist()]
+    index = pd.MultiIndex.from_arrays([dataset.names, box_id], names=["id", "box_id"])
+    columns = ["box_top", "box_left", "box_width", "box_height"]
+    for name in dataset.part_names.tolist():
+        columns += [f"X{name}", f"Y{name}"]
+    # (boxes, 4 + 2 * parts): box coordinates followed by X0 Y0 X1 Y1 ...
+    values = np.hstack(
+        [
+            dataset.boxes.astype(np.float64),
+            dataset.coords.astype(np.float64).reshape(len(dataset), -1),
+        ]
+    )
+    df = pd.DataFrame(values, index=index, columns=columns)
+    if not df.index.is_unique:
+        # Boxes with the same id and coordinates are merged into one row, as they always were
+        df = df.groupby(level=["id", "box_id"], sort=False).max()
+    if write_csv:
+        basename = ntpath.splitext(xml_file)[0]
+        df.to_csv(f"{basename}.csv")
     return df
 
 
@@ -309,14 +1091,18 @@ def dlib_xml_to_tps(xml_file: str):
         for images in root:
             for image in images:
                 for boxes in image:
+                    # Boxes span the whole image unless the image size was written explicitly
+                    # (predictions made inside a detected box).
+                    if "height" in image.attrib:
+                        height = float(image.attrib["height"])
+                    else:
+                        height = float(boxes.attrib["height"]) + 2
                     wr.writerows([["LM=" + str(int(len(boxes)))]])
                     for parts in boxes:
                         if parts.attrib["name"] is not None:
                             data = [
                                 float(parts.attrib["x"]),
-                                float(boxes.attrib["height"])
-                                + 2
-                                - float(parts.attrib["y"]),
+                                height - float(parts.attrib["y"]),
                             ]
                         wr.writerows([data])
                     wr.writerows(
@@ -350,41 +1136,23 @@ def read_csv(input):
             coords_array.append(coords)
     return {'im': im, 'coords': coords_array}
 
-def read_tps(input):
+def read_tps(input, cache=True):
     '''
     This function reads a tps coordinate file containing several specimens and an arbitrary number of landmarks. 
     A single image file can contain as many specimens as wanted.
     It is generally assumed here that all specimens were landmarked in the same order.It is also  assumed that 
-    the file contains no missing values.
+    the file contains no missing values. See tps.read_tps for the streaming parser.
     
     Parameters:
         input (str): The tps coordinate file
+        cache (bool): load the file from its binary sidecar files when they are up to date (see tps.cache_paths)
     Returns:
-        dict: dictionary containing four keys 
-        (lm= number of landmarks,im= image id, scl= scale, coords= array with 2D coordinates)
+        dict: dictionary containing the keys 
+        (lm= number of landmarks,im= image id, scl= scale, coords= array with 2D coordinates), plus the
+        id, comment, points and offsets keys described in tps.read_tps
     
     '''
-    tps_file = open(input, 'r') 
-    tps = tps_file.read().splitlines()
-    tps_file.close()
-    lm, im, sc, coords_array = [], [], [], []
-
-    for i, ln in enumerate(tps):
-        if ln.startswith("LM"):
-            lm_num = int(ln.split('=')[1])
-            lm.append(lm_num)
-            coords_mat = []
-            for j in range(i + 1, i + 1 + lm_num):
-                coords_mat.append(tps[j].split(' '))
-            coords_mat = np.array(coords_mat, dtype=float)
-            coords_array.append(coords_mat)
-
-        if ln.startswith("IMAGE"):
-            im.append(ln.split('=')[1])
-
-        if ln.startswith("SCALE"):
-            sc.append(ln.split('=')[1])
-    return {'lm': lm, 'im': im, 'scl': sc, 'coords': coords_array}
+    return tps.read_tps(input, cache=cache)
 
 
 #dlib xml tools
@@ -484,21 +1252,23 @@ def generate_dlib_xml(images,sizes,folder='train',out_file='output.xml'):
     images_e = ET.Element('images')
     root.append(images_e)
 
+    # One directory listing instead of a stat per specimen, and image elements indexed by path
+    # so that extra boxes are attached to their image in constant time
+    present_files = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+    image_elements = {}
+
     for i in range(0,len(images['im'])):
         name=os.path.splitext(images['im'][i])[0]+'.jpg'
         path=os.path.join(folder,name)
-        if os.path.isfile(path) is True: 
-            present_tags=[]
-            for img in images_e.findall('image'):
-                present_tags.append(img.get('file'))   
-
-            if path in present_tags:
-                pos=present_tags.index(path)           
-                images_e[pos].append(add_bbox_element(images['coords'][i],sizes[name]))
-
-            else:    
-                images_e.append(add_image_element(name,images['coords'][i],sizes[name],path))
-            
+        if name in present_files:
+            if path in image_elements:
+                image_elements[path].append(add_bbox_element(images['coords'][i],sizes[name]))
+
+            else:
+                image_e = add_image_element(name,images['coords'][i],sizes[name],path)
+                image_elements[path] = image_e
+                images_e.append(image_e)
+
     et = ET.ElementTree(root)
     xmlstr = minidom.parseString(ET.tostring(et.getroot())).toprettyxml(indent="   ")
     with open(out_file, "w") as f:
@@ -507,14 +1277,21 @@ def generate_dlib_xml(images,sizes,folder='train',out_file='output.xml'):
 #Directory preparation tools
 
 
-def split_train_test(input_dir):
+def split_train_test(input_dir, workers=8, assignments=None):
     '''
     Splits an image directory into 'train' and 'test' directories. The original image directory is preserved. 
     When creating the new directories, this function converts all image files to 'jpg'. The function returns
     a dictionary containing the image dimensions in the 'train' and 'test' directories.
+    Existing 'train' and 'test' directories are updated rather than rebuilt: images that are already up to date
+    are left alone and files that no longer belong to a split are removed.
     
     Parameters:
         input_dir(str)=original image directory
+        workers(int)=number of images prepared in parallel
+        assignments(dict)=(optional) image file -> 'train' or 'test', as kept in a manifest (see load_manifest).
+            Images keep their recorded split, new images are assigned with assign_split and the dictionary is
+            updated in place. Without it, images are shuffled with a fixed seed (80/20 split), so every image
+            may change split when the number of files changes.
         
     Returns:
         sizes (dict): dictionary containing the image dimensions in the 'train' and 'test' directories.
@@ -523,36 +1300,134 @@ def split_train_test(input_dir):
     filenames = os.listdir(input_dir)
     filenames = [os.path.join(input_dir, f) for f in filenames if not f.startswith('.')]
 
-    # Splitting the images into 'train' and 'test' directories (80/20 split)
-    random.seed(845)
-    filenames.sort()
-    random.shuffle(filenames)
-    split = int(0.8 * len(filenames))
-    train_set = filenames[:split]
-    test_set = filenames[split:]
-
-    filenames = {'train':train_set,
-                 'test': test_set}
-    sizes={}
+    if assignments is not None:
+        basenames = {os.path.basename(f) for f in filenames}
+        for f in list(assignments):
+            if f not in basenames:
+                del assignments[f]
+        filenames.sort()
+        for f in filenames:
+            basename = os.path.basename(f)
+            if basename not in assignments:
+                assignments[basename] = assign_split(basename)
+        filenames = {split: [f for f in filenames if assignments[os.path.basename(f)] == split]
+                     for split in ['train','test']}
+    else:
+        # Splitting the images into 'train' and 'test' directories (80/20 split)
+        random.seed(845)
+        filenames.sort()
+        random.shuffle(filenames)
+        split = int(0.8 * len(filenames))
+        train_set = filenames[:split]
+        test_set = filenames[split:]
+
+        filenames = {'train':train_set,
+                     'test': test_set}
+    # Images sharing a basename end up in the same file, the last one wins as when they were written in turn
+    jobs = {}
     for split in ['train','test']:
-        sizes[split]={}
-        if not os.path.exists(split):
-            os.mkdir(split)
-        else:
-            print("Warning: the folder {} already exists. It's being replaced".format(split))
-            shutil.rmtree(split)
-            os.mkdir(split)
-
+        os.makedirs(split, exist_ok=True)
         for filename in filenames[split]:
             basename=os.path.basename(filename)
             name=os.path.splitext(basename)[0] + '.jpg'
-            sizes[split][name]=image_prep(filename,name,split)
+            jobs[(split, name)] = filename
+
+    for split in ['train','test']:
+        for f in os.listdir(split):
+            if (split, f) not in jobs:
+                os.remove(os.path.join(split, f))
+
+    sizes={'train':{}, 'test':{}}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda job: image_prep(job[1], job[0][1], job[0][0]), jobs.items())
+        for (split, name), file_sz in zip(jobs, results):
+            if file_sz is not None:
+                sizes[split][name]=file_sz
     return sizes
 
+def assign_split(name, train_fraction=0.8):
+    '''
+    Assigns an image to the 'train' or 'test' split from the sha1 digest of its file name, so an image always
+    lands in the same split whatever other images are present.
+    
+    Parameters:
+        name(str)=basename of the image file
+        train_fraction(float)=expected fraction of images assigned to 'train'
+        
+    Returns:
+        split (str): 'train' or 'test'
+    '''
+    position = int(hashlib.sha1(name.encode('utf-8')).hexdigest()[:8], 16) / 0x100000000
+    return 'train' if position < train_fraction else 'test'
+
+def load_manifest(path, input_dir):
+    '''
+    Loads the manifest of an incremental preprocessing run. The manifest records the split of every image
+    ('images') and a digest of the inputs of each generated xml file ('outputs'). When the manifest does not
+    exist yet, the split of the images already found in the 'train' and 'test' directories is kept.
+    
+    Parameters:
+        path(str)=manifest file (json)
+        input_dir(str)=original image directory
+        
+    Returns:
+        manifest (dict): dictionary with the 'images' and 'outputs' keys
+    '''
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    manifest = {'images': {}, 'outputs': {}}
+    previous = {}
+    for split in ['train','test']:
+        if os.path.isdir(split):
+            for f in os.listdir(split):
+                previous[os.path.splitext(f)[0]] = split
+    if os.path.isdir(input_dir):
+        for f in sorted(os.listdir(input_dir)):
+            stem = os.path.splitext(f)[0]
+            if not f.startswith('.') and stem in previous:
+                manifest['images'][f] = previous[stem]
+    return manifest
+
+def save_manifest(path, manifest):
+    '''
+    Writes the manifest of an incremental preprocessing run. The file is replaced in one step, so an
+    interrupted run keeps the previous manifest.
+    
+    Parameters:
+        path(str)=manifest file (json)
+        manifest(dict)=dictionary returned by load_manifest
+        
+    Returns:
+        None (file written to disk)
+    '''
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def split_digest(sizes, coordinate_file):
+    '''
+    Digest of everything an xml file generated by generate_dlib_xml depends on: the images of the split with
+    their dimensions and the content of the coordinate file.
+    
+    Parameters:
+        sizes(dict)=image dimensions of one split, as returned by split_train_test
+        coordinate_file(str)=tps or csv coordinate file
+        
+    Returns:
+        digest (str): hexadecimal sha1 digest
+    '''
+    sha1 = hashlib.sha1(json.dumps(sorted(sizes.items())).encode('utf-8'))
+    sha1.update(file_hash(coordinate_file).encode('utf-8'))
+    return sha1.hexdigest()
+
 def image_prep(file, name, dir_path):
     '''
-    Internal function used by the split_train_test function. Reads the original image files and, while 
-    converting them to jpg, gathers information on the original image dimensions. 
+    Internal function used by the split_train_test function. Gathers the original image dimensions from the
+    file header and places the image in dir_path as a jpg. Files that are already jpgs are hard linked (or copied
+    when linking is not possible); other formats, and jpgs that need an EXIF rotation, are converted with OpenCV.
+    Nothing is written when the file in dir_path is already up to date.
     
     Parameters:
         file(str)=original path to the image file
@@ -560,14 +1435,43 @@ def image_prep(file, name, dir_path):
         dir_path(str)= directory where the image file should be saved to
         
     Returns:
-        file_sz(array): original image dimensions
+        file_sz(array): original image dimensions, or None if the file is not an image
     '''
+    out = os.path.join(dir_path,name)
+    try:
+        with Image.open(file) as img:
+            file_sz = [img.height, img.width]
+            orientation = img.getexif().get(0x0112, 1)
+            # Grayscale and RGB jpgs can be used as they are
+            copy = img.format == 'JPEG' and img.mode in ('L', 'RGB') and orientation == 1
+            # cv2.imread applies the EXIF rotation, which swaps the sides for orientations 5 to 8
+            if orientation in (5, 6, 7, 8):
+                file_sz = file_sz[::-1]
+    except Exception:
+        # Formats that PIL cannot read are left to OpenCV
+        file_sz = None
+        copy = False
+
+    src = os.stat(file)
+    if os.path.exists(out):
+        dst = os.stat(out)
+        if os.path.samestat(src, dst) or (dst.st_mtime_ns >= src.st_mtime_ns and file_sz is not None):
+            return file_sz
+        os.remove(out)
+
+    if copy:
+        try:
+            os.link(file, out)
+        except OSError:
+            shutil.copy2(file, out)
+        return file_sz
+
     img = cv2.imread(file)
     if img is None:
         print('File {} was ignored'.format(file))
-    else:
-        file_sz= [img.shape[0],img.shape[1]]
-        cv2.imwrite(os.path.join(dir_path,name), img)
+        return None
+    file_sz= [img.shape[0],img.shape[1]]
+    cv2.imwrite(out, img)
     return file_sz
 
 
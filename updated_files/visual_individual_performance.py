@@ -1,124 +1,32 @@
-import xml.etree.ElementTree as ET
 import numpy as np
 import argparse
-import numpy as np
-from collections import defaultdict
 import matplotlib.pyplot as plt
 import cv2
 import os
+import landmarks
 
-def parse_xml(file_path):
-    '''
-    Parses an XML file to extract image filenames and their corresponding landmark coordinates.
-
-    Parameters:
-        file_path (str): Path to the XML file containing image data and landmarks.
-
-    Returns:
-        dict: A dictionary where keys are image filenames and values are dictionaries of landmarks, 
-            with landmark names as keys and their (x, y) coordinates as values.
-            Note: Returns the first entry only.
-    '''
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    
-    # Dictionary to store image filenames and their corresponding landmarks
-    data = {}
-    
-    for image in root.findall('.//image'):
-        image_file = image.get('file')
-        parts = {}
-        for part in image.findall('.//part'):
-            part_name = int(part.get('name'))
-            x = float(part.get('x'))
-            y = float(part.get('y'))
-            parts[part_name] = (x, y)
-        
-        data[image_file] = parts
-    return data
-
-def find_groundtruth(file_path, image_name):
+def find_landmarks(dataset, image_name):
     '''
-    Finds the ground truth landmark coordinates for a specified image in an XML file.
+    Retrieves the landmark coordinates for a specified image.
 
     Parameters:
-        file_path (str): Path to the XML file containing image data and landmarks.
+        dataset (LandmarkDataset): Landmarks loaded from a ground truth or model output file.
         image_name (str): The name of the image for which to retrieve landmark coordinates.
 
     Returns:
-        list: A list containing two lists: 
-            - The first list contains the x-coordinates of the landmarks.
-            - The second list contains the y-coordinates of the landmarks.
-            If the image is not found, both lists will be empty.
-    '''
-
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    ground_truth = []
-    X = []
-    Y = []
-    for image in root.findall('.//image'):
-        image_file = image.get('file')
-        if image_file == image_name:
-            for part in image.findall('.//part'):
-                x = int(part.get('x'))
-                y = int(part.get('y'))
-                X.append(x)
-                Y.append(y)
-    return [X, Y]
-
-def find_output(file_path, image_name):
-    '''
-    Retrieves the landmark coordinates for a specified image from an XML file.
+        list: A list containing two arrays: 
+            - The first array contains the x-coordinates of the landmarks.
+            - The second array contains the y-coordinates of the landmarks.
+            If the image is not found, both are empty.
 
-    Parameters:
-        file_path (str): Path to the XML file containing image data and landmarks.
-        image_name (str): The name of the image for which to retrieve landmark coordinates.
-
-    Returns:
-        list: A list containing two lists: 
-            - The first list contains the x-coordinates of the landmarks.
-            - The second list contains the y-coordinates of the landmarks.
-            If the image is not found, both lists will be empty.
-
-    Note: The input `image_name` is modified to remove './' for comparison.
-    '''
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    ground_truth = []
-    X = []
-    Y = []
-    for image in root.findall('.//image'):
-        image_file = image.get('file')
-        image_file = image_file.replace('./', '')
-        # print("n:", image_name, "f:", image_file)
-        if image_file == image_name:
-            # print(image_name)
-            for part in image.findall('.//part'):
-                x = int(part.get('x'))
-                y = int(part.get('y'))
-                X.append(x)
-                Y.append(y)
-    return [X, Y]
-
-def get_image_name(lizard_number, groundtruth_xml):
-    '''
-    Retrieves the file name of an image corresponding to a specified lizard number 
-    from a groundtruth XML file.
-
-    Parameters:
-        lizard_number (int): The index of the lizard whose image file name is to be retrieved.
-        groundtruth_xml (str): The path to the XML file containing image metadata.
-
-    Returns:
-        str: The file name of the image corresponding to the given lizard number.
+    Note: Image names are compared after normalization, so './' prefixes and path separators are ignored.
     '''
-    tree = ET.parse(groundtruth_xml)
-    root = tree.getroot()
-    for i, image in enumerate(root.findall('.//image')):
-        if int(i) == int(lizard_number):
-            return image.get('file')
+    row = dataset.lookup(image_name)
+    if row is None:
+        return [[], []]
+    coords = dataset.coords[row]
+    coords = coords[~np.isnan(coords[:, 0])]
+    return [coords[:, 0], coords[:, 1]]
 
 def main(groundtruth_xml, output_xml, output_folder):
     '''
@@ -142,15 +50,13 @@ def main(groundtruth_xml, output_xml, output_folder):
     # Create the output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
 
-    # Parse the groundtruth XML to find the number of images
-    tree = ET.parse(groundtruth_xml)
-    root = tree.getroot()
-    num_images = len(root.findall('.//image'))
+    # Both files are parsed once; images are then looked up by name
+    groundtruth_data = landmarks.load_xml(groundtruth_xml)
+    output_data = landmarks.load_xml(output_xml)
 
-    for lizard_number in range(num_images):
-        name = get_image_name(lizard_number, groundtruth_xml)
-        groundtruth = find_groundtruth(groundtruth_xml, name)
-        output = find_output(output_xml, name)
+    for lizard_number, name in enumerate(dict.fromkeys(groundtruth_data.names)):
+        groundtruth = find_landmarks(groundtruth_data, name)
+        output = find_landmarks(output_data, name)
 
         image = cv2.imread(name)
         plt.imshow(image)
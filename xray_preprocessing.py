@@ -1,37 +1,196 @@
 import argparse
 import cv2
+import functools
 import glob
+import json
 import matplotlib.pyplot as plt
 import os
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pydicom
 from pydicom.pixel_data_handlers.util import apply_voi_lut
 import numpy as np
 from PIL import Image, ImageEnhance
 
-def dcm_to_jpeg(dcm_file_path, jpeg_file_path):
-    dicom = pydicom.dcmread(dcm_file_path)
-    
-    # If DICOM file has a VOI LUT (Value of Interest Look-Up Table), apply it
-    if hasattr(dicom, 'VOILUTFunction'):
-        image = apply_voi_lut(dicom.pixel_array, dicom)
+def dcm_to_jpeg(dcm_file_path, jpeg_file_path, grayscale=False, low_memory=False, strip_rows=256, work_dtype=np.float32):
+    """Convert a DICOM file to an 8-bit JPEG, stretching its pixel values (after the VOI LUT, if any) to 0-255.
+
+    Args:
+        dcm_file_path (str): Path of the DICOM file.
+        jpeg_file_path (str): Path to save the JPEG file.
+        grayscale (bool, optional): Save a single channel JPEG instead of an RGB one. Defaults to False.
+        low_memory (bool, optional): Process the pixel data in strips of rows, reading them straight from the file
+            when it is uncompressed, so that only the 8-bit output is held in memory. Defaults to False.
+        strip_rows (int, optional): Number of rows per strip in low memory mode. Defaults to 256.
+        work_dtype (dtype, optional): Type the VOI LUT output is held in, per strip, in low memory mode. Defaults to float32.
+    """
+    if low_memory:
+        dicom = pydicom.dcmread(dcm_file_path, defer_size='64 KB')
+        image = _strips_to_uint8(dicom, dcm_file_path, strip_rows, work_dtype)
     else:
-        image = dicom.pixel_array
-    
-    image = image - np.min(image)
-    image = image / np.max(image)
-    image = (image * 255).astype(np.uint8)
+        dicom = pydicom.dcmread(dcm_file_path)
+
+        # If DICOM file has a VOI LUT (Value of Interest Look-Up Table), apply it
+        if hasattr(dicom, 'VOILUTFunction'):
+            image = apply_voi_lut(dicom.pixel_array, dicom)
+        else:
+            image = dicom.pixel_array
 
-    # Convert to RGB
-    if len(image.shape) == 2:  # If grayscale, convert to RGB
+        # Stretch to 8 bits in one pass, without float64 temporaries of the whole frame
+        image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+    # Convert to RGB, unless the single channel should be kept
+    if len(image.shape) == 2 and not grayscale:  # If grayscale, convert to RGB
         image = np.stack((image,) * 3, axis=-1)
     
     pil_image = Image.fromarray(image)
     pil_image.save(jpeg_file_path, 'JPEG')
 
+def pixel_data_memmap(dicom, dcm_file_path):
+    """Memory map the first frame of the pixel data of a DICOM file read with a defer_size.
+
+    Returns None when the pixel data cannot be mapped: compressed, deflated or big endian transfer syntaxes,
+    several samples per pixel, or pixel data that was not deferred. The mapped values still hold whatever the
+    file has in the bits above BitsStored, see stored_bits.
+    """
+    syntax = dicom.file_meta.get('TransferSyntaxUID') if hasattr(dicom, 'file_meta') else None
+    if syntax is None or syntax.is_compressed or syntax.is_deflated or not syntax.is_little_endian:
+        return None
+    if dicom.get('SamplesPerPixel', 1) != 1 or dicom.get('BitsAllocated') not in (8, 16, 32):
+        return None
+    try:
+        element = dicom.get_item('PixelData', keep_deferred=True)
+    except TypeError:
+        # pydicom < 3 returns the deferred element as it is
+        element = dicom.get_item('PixelData')
+    offset = getattr(element, 'value_tell', None)
+    if offset is None:
+        return None
+    dtype = np.dtype('<{}{}'.format('i' if dicom.PixelRepresentation else 'u', dicom.BitsAllocated // 8))
+    return np.memmap(dcm_file_path, dtype=dtype, mode='r', offset=offset, shape=(dicom.Rows, dicom.Columns))
+
+def stored_bits(strip, dicom):
+    """Keep the BitsStored low bits of raw pixel values, sign-extending them for signed pixel data.
+
+    Plates commonly store 12 or 14 bits in 16; the bits above may hold overlays or noise.
+    """
+    shift = dicom.BitsAllocated - dicom.get('BitsStored', dicom.BitsAllocated)
+    if shift <= 0:
+        return strip
+    if dicom.PixelRepresentation:
+        # Move the sign bit of the stored value to the top, and back with an arithmetic shift
+        return (strip << shift) >> shift
+    return strip & strip.dtype.type((1 << (dicom.BitsAllocated - shift)) - 1)
+
+def _strips_to_uint8(dicom, dcm_file_path, strip_rows=256, work_dtype=np.float32):
+    # Two passes over strips of rows: the range of the (VOI LUT) values, then the stretch to 0-255 into the output
+    pixels = pixel_data_memmap(dicom, dcm_file_path)
+    mapped = pixels is not None
+    if not mapped:
+        pixels = dicom.pixel_array
+        if pixels.ndim == 3 and dicom.get('SamplesPerPixel', 1) == 1:
+            pixels = pixels[0]
+    voi = hasattr(dicom, 'VOILUTFunction')
+
+    def strips():
+        for start in range(0, pixels.shape[0], strip_rows):
+            strip = np.asarray(pixels[start:start + strip_rows])
+            if mapped:
+                # pixel_array does this for the pixel data it decodes
+                strip = stored_bits(strip, dicom)
+            if strip.dtype == np.uint32:
+                # OpenCV has no unsigned 32-bit type
+                strip = strip.astype(work_dtype)
+            yield start, (apply_voi_lut(strip, dicom).astype(work_dtype, copy=False) if voi else strip)
+
+    low, high = np.inf, -np.inf
+    for _, strip in strips():
+        # In float: NumPy scalars of the unsigned pixel type would wrap around in -low * alpha below
+        low, high = min(low, float(strip.min())), max(high, float(strip.max()))
+    # Same scale and shift as cv2.normalize(NORM_MINMAX)
+    alpha = 255.0 / (high - low) if high > low else 0.0
+    beta = -low * alpha
+
+    image = np.empty(pixels.shape[:2], dtype=np.uint8)
+    for start, strip in strips():
+        # The values are at least low, so the absolute value of convertScaleAbs changes nothing
+        image[start:start + len(strip)] = cv2.convertScaleAbs(strip, alpha=alpha, beta=beta)
+    return image
+
+def traced_peak(func, *args, **kwargs):
+    """Call func and return its result with the peak memory (bytes) allocated through Python during the call."""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        result = func(*args, **kwargs)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        if started:
+            tracemalloc.stop()
+
+# PIL's SMOOTH filter, used by ImageEnhance.Sharpness as the blurred image to extrapolate from
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+@functools.lru_cache(maxsize=8)
+def sharpness_table(sharpness):
+    """Image.blend of every (smooth, image) pair of 8-bit levels, as a 65536-entry table indexed by smooth << 8 | image.
+
+    Holds smooth + sharpness * (image - smooth) computed in float32, then clipped and truncated, as PIL does.
+    """
+    smooth, image = np.divmod(np.arange(1 << 16, dtype=np.float32), np.float32(256))
+    table = smooth + np.float32(sharpness) * (image - smooth)
+    return np.clip(table, 0, 255).astype(np.uint8)
+
 # Function to enhance image sharpness, contrast and apply Gaussian blur
 def enhance_image(img, sharpness=4, contrast=1.3, blur=3):
     """Enhance image sharpness, contrast, and blur.
 
+    Reproduces enhance_image_pil with OpenCV, without the PIL copies: the output matches it exactly
+    (see tests/test_xray_preprocessing.py). Like enhance_image_pil, a colour input is returned in RGB
+    channel order; a single channel image stays single channel.
+
+    Args:
+        img: Loaded cv2 image, colour (BGR) or single channel.
+        sharpness (float, optional): Sharpness level. Defaults to 4.
+        contrast (float, optional): Contrast level. Defaults to 1.3.
+        blur (int, optional): Blur level. Defaults to 3.
+    """
+
+    # Sharpness: extrapolate from the smoothed image. PIL leaves the border pixels unfiltered
+    smooth = cv2.filter2D(img, -1, SMOOTH_KERNEL, borderType=cv2.BORDER_REPLICATE)
+    smooth[0], smooth[-1] = img[0], img[-1]
+    smooth[:, 0], smooth[:, -1] = img[:, 0], img[:, -1]
+    # Blended as Image.blend does through a table of every pair of levels, written over smooth. np.take
+    # converts its indices to intp, so they are built for strips of rows rather than the whole frame
+    table = sharpness_table(float(sharpness))
+    for start in range(0, img.shape[0], 256):
+        index = smooth[start:start + 256].astype(np.intp)
+        index <<= 8
+        index |= img[start:start + 256]
+        np.take(table, index, out=smooth[start:start + 256], mode='clip')
+    img_enhanced = smooth
+
+    # Contrast: scale around the rounded mean of the grey image, as a lookup table
+    gray = img_enhanced if img_enhanced.ndim == 2 else cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2GRAY)
+    mean = np.float32(int(cv2.mean(gray)[0] + 0.5))
+    table = mean + np.float32(contrast) * (np.arange(256, dtype=np.float32) - mean)
+    table = np.clip(table, 0, 255).astype(np.uint8)
+    cv2.LUT(img_enhanced, table, dst=img_enhanced)
+
+    # Apply a small amount of Gaussian blur
+    cv2.GaussianBlur(img_enhanced, (blur, blur), 0, dst=img_enhanced)
+
+    if img_enhanced.ndim == 3:
+        cv2.cvtColor(img_enhanced, cv2.COLOR_BGR2RGB, dst=img_enhanced)
+    return img_enhanced
+
+# PIL implementation of enhance_image, kept as the reference for its output
+def enhance_image_pil(img, sharpness=4, contrast=1.3, blur=3):
+    """Enhance image sharpness, contrast, and blur with PIL's ImageEnhance.
+
     Args:
         img: Loaded cv2 image.
         output_path (str): Path to save the enhanced image.
@@ -63,8 +222,14 @@ def enhance_image(img, sharpness=4, contrast=1.3, blur=3):
     return img_enhanced
 
 def clahe(image, clipLimit=2.0, tileGridSize=(8, 8)):
+    return equalize(image, cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=tuple(tileGridSize)))
+
+def equalize(image, clahe):
+    """Apply a CLAHE operator to a single channel image, or to the luminance of a colour image."""
+    if image.ndim == 2:
+        # Single channel x-rays are equalized directly
+        return clahe.apply(image)
     img_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
     img_yuv[:, :, 0] = clahe.apply(img_yuv[:, :, 0])
     img_output = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR)
     return img_output
@@ -73,10 +238,173 @@ def image_complement(image):
     img_complement = cv2.bitwise_not(image)
     return img_complement
 
+def gamma_table(gamma=1.0):
+    return compile_tone_lut([('gamma', gamma)])
+
 def gamma_correction(image, gamma=1.0):
-    invGamma = 1.0 / gamma
-    table = np.array([((i / 255.0) ** invGamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
-    return cv2.LUT(image, table)
+    return cv2.LUT(image, gamma_table(gamma))
+
+# Point-wise tone steps. Each maps the integer levels 0..maxval to new integer levels, rounding the
+# same way as the step applied on its own (gamma_correction, PIL's Contrast, image_complement)
+def _tone_gamma(levels, maxval, gamma):
+    return (levels / maxval) ** (1.0 / gamma) * maxval
+
+def _tone_contrast(levels, maxval, factor, pivot=None):
+    # PIL's Contrast blends with a flat image in float32; here the grey level is fixed instead of the image mean
+    pivot = np.float32((maxval + 1) // 2 if pivot is None else pivot)
+    return pivot + np.float32(factor) * (levels.astype(np.float32) - pivot)
+
+def _tone_complement(levels, maxval):
+    return maxval - levels
+
+def _tone_window(levels, maxval, low, high):
+    return np.rint((levels - low) * (maxval / (high - low)))
+
+TONE_STEPS = {'gamma': _tone_gamma, 'contrast': _tone_contrast, 'complement': _tone_complement, 'window': _tone_window}
+
+def parse_tone_steps(specs):
+    """Parse tone steps written as 'name' or 'name:arg1,arg2', e.g. 'contrast:1.2,128', 'gamma:0.8', 'complement'.
+
+    Args:
+        specs (list): Step specifications.
+    """
+    steps = []
+    for spec in specs:
+        name, _, params = spec.partition(':')
+        if name not in TONE_STEPS:
+            raise ValueError("Unknown tone step {} (expected one of {})".format(name, ', '.join(TONE_STEPS)))
+        steps.append((name,) + tuple(float(p) for p in params.split(',') if p))
+    return steps
+
+def compile_tone_lut(steps, depth=8):
+    """Compose point-wise tone steps into one lookup table.
+
+    Every step is applied to the table in turn and clipped and truncated to integer levels, so applying
+    the table is identical to applying the steps one after the other, in a single pass.
+
+    Args:
+        steps (list): Steps as (name, *params) tuples, see TONE_STEPS and parse_tone_steps.
+        depth (int, optional): Bit depth of the images, 8 (256 entries) or 16 (65536 entries, used by
+            xray_preprocessing_dicom). Defaults to 8.
+    """
+    dtype = {8: np.uint8, 16: np.uint16}[depth]
+    maxval = (1 << depth) - 1
+    table = np.arange(maxval + 1, dtype=np.float64)
+    for name, *params in steps:
+        table = np.clip(TONE_STEPS[name](table, maxval, *params), 0, maxval).astype(dtype).astype(np.float64)
+    return table.astype(dtype)
+
+def apply_tone_lut(image, table, dst=None):
+    """Apply a table from compile_tone_lut.
+
+    8-bit images use cv2.LUT, which only accepts 8-bit input. 16-bit images are looked up with np.take,
+    in strips of rows because it converts its indices to intp.
+    """
+    if table.dtype == np.uint8:
+        return cv2.LUT(image, table, dst=dst)
+    if dst is None:
+        dst = np.empty(image.shape, dtype=table.dtype)
+    for start in range(0, image.shape[0], 256):
+        np.take(table, image[start:start + 256], out=dst[start:start + 256], mode='clip')
+    return dst
+
+def save_tone_lut(path, steps, table, settings=None):
+    """Write the tone steps and their composed table to a json file, so that a run can be reproduced.
+
+    The settings the outputs were written with are kept with them, see logged_settings.
+    """
+    with open(path, 'w') as f:
+        json.dump({'steps': [list(step) for step in steps], 'depth': int(table.dtype.itemsize * 8),
+                   'table': table.tolist(), 'settings': settings}, f)
+
+def logged_settings(path):
+    """Return the settings recorded by save_tone_lut, or None if the file is missing or has none."""
+    try:
+        with open(path) as f:
+            return json.load(f).get('settings')
+    except (OSError, ValueError):
+        return None
+
+class EnhancementProfile:
+    """Enhancement operators built once from the settings and reused for every image of a batch.
+
+    The CLAHE operator is created once, and gamma correction, the optional tone steps and the
+    complement are compiled into a single lookup table applied in one pass (skipped when it is the
+    identity). The contrast stretch of enhance_image cannot be folded into that table because it
+    depends on the image mean and is followed by the blur and CLAHE.
+
+    Args:
+        sharpness (float, optional): Sharpness level. Defaults to 4.
+        contrast (float, optional): Contrast level. Defaults to 1.3.
+        blur (int, optional): Blur level. Defaults to 3.
+        clip_limit (float, optional): Clip limit for CLAHE. Defaults to 2.0.
+        tile_grid_size (tuple, optional): Tile grid size for CLAHE. Defaults to (8, 8).
+        gamma (float, optional): Gamma for gamma correction. Defaults to 1.0.
+        tone (list, optional): Further tone steps applied after gamma correction, see parse_tone_steps.
+        complement (bool, optional): Invert the processed image. Defaults to False.
+        grayscale (bool, optional): Read, enhance and save images as a single channel. Defaults to False.
+    """
+
+    def __init__(self, sharpness=4, contrast=1.3, blur=3, clip_limit=2.0, tile_grid_size=(8, 8), gamma=1.0,
+                 tone=(), complement=False, grayscale=False):
+        self.sharpness = sharpness
+        self.contrast = contrast
+        self.blur = blur
+        self.grayscale = grayscale
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tuple(tile_grid_size))
+        self.steps = [('gamma', gamma)] + list(tone) + ([('complement',)] if complement else [])
+        self.table = compile_tone_lut(self.steps)
+        self.identity = np.array_equal(self.table, np.arange(256))
+
+    def apply(self, image):
+        """Enhance a loaded cv2 image."""
+        image = enhance_image(image, self.sharpness, self.contrast, self.blur)
+        image = equalize(image, self.clahe)
+        if not self.identity:
+            apply_tone_lut(image, self.table, dst=image)
+        return image
+
+# Profile of the current worker process. CLAHE operators cannot be pickled, so every worker
+# builds its own from the settings
+_profile = None
+
+def _init_worker(settings):
+    global _profile
+    # Each worker processes a whole image, so OpenCV's own threads would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    _profile = EnhancementProfile(**settings)
+
+def is_up_to_date(input_path, output_path):
+    """Return True if output_path exists and is at least as recent as input_path."""
+    try:
+        return os.stat(output_path).st_mtime_ns >= os.stat(input_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def process_file(input_path, output_path, quality=95, return_image=False, profile=None):
+    """Read, enhance and write one image.
+
+    Args:
+        input_path (str): Path of the input image.
+        output_path (str): Path to save the processed image.
+        quality (int, optional): JPEG quality of the output. Defaults to 95.
+        return_image (bool, optional): Return the processed image instead of the output path. Defaults to False.
+        profile (EnhancementProfile, optional): Enhancement to apply. Defaults to the profile of the worker.
+    """
+    profile = profile or _profile
+    image = cv2.imread(input_path, cv2.IMREAD_GRAYSCALE if profile.grayscale else cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not read " + input_path)
+
+    image = profile.apply(image)
+
+    if not cv2.imwrite(output_path, image, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        raise ValueError("Could not write " + output_path)
+    return image if return_image else output_path
+
+def convert_file(input_path, output_path, grayscale=False, low_memory=False, strip_rows=256):
+    """Convert one DICOM file to JPEG and return the peak memory allocated through Python while converting it."""
+    return traced_peak(dcm_to_jpeg, input_path, output_path, grayscale, low_memory, strip_rows)[1]
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Apply image enhancement techniques to improve XRAY image.')
@@ -89,25 +417,80 @@ if __name__ == '__main__':
     parser.add_argument('--tile_grid_size', type=int, nargs=2, default=(8, 8), help='Tile grid size for CLAHE (two integers)')
     parser.add_argument('--gamma', type=float, default=1.0, help='Gamma for gamma correction')
     parser.add_argument('--shouldPlotEveryImage', type=bool, default=False, help='Whether to plot and display each image after processing')
+    parser.add_argument('--tone', type=str, nargs='+', default=[], help="Point-wise steps applied after gamma correction in the same lookup table, e.g. contrast:1.2,128 gamma:0.8 window:20,235 complement")
+    parser.add_argument('--complement', action='store_true', help='Invert the processed images')
+    parser.add_argument('--grayscale', action='store_true', help='Read, enhance and save the images as a single channel')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of images processed in parallel')
+    parser.add_argument('--quality', type=int, default=95, help='JPEG quality of the processed images')
+    parser.add_argument('--dicom', action='store_true', help='Convert the DICOM (.dcm) files of the input folder to JPEG instead of enhancing JPEG files')
+    parser.add_argument('--low_memory', action='store_true', help='With --dicom, convert the pixel data in strips of rows, read straight from uncompressed files')
+    parser.add_argument('--strip_rows', type=int, default=256, help='Rows per strip with --low_memory')
+    parser.add_argument('--force', action='store_true', help='Process images even if their output is newer than the input')
 
     args = parser.parse_args()
 
-    for root, dirs, files in os.walk(args.input_folder):
-        jpg_files = glob.glob(os.path.join(root, '*.jpg'))
-        for jpg_file in jpg_files:
-            print("Processing " + jpg_file)
-            image = cv2.imread(jpg_file)
-
-            image = enhance_image(image)
-            image = clahe(image, args.clip_limit, args.tile_grid_size)
-            image = gamma_correction(image, args.gamma)
+    settings = {'sharpness': args.sharpness, 'contrast': args.contrast, 'blur': args.blur,
+                'clip_limit': args.clip_limit, 'tile_grid_size': tuple(args.tile_grid_size), 'gamma': args.gamma,
+                'tone': parse_tone_steps(args.tone), 'complement': args.complement, 'grayscale': args.grayscale}
+    os.makedirs(args.output_folder, exist_ok=True)
 
-            if args.shouldPlotEveryImage:
-              plt.plot()
-              plt.title("Processed Image") 
-              plt.imshow(image)
-              plt.show()
+    profile = EnhancementProfile(**settings)
+    print("Tone steps: " + ", ".join(':'.join(str(v) for v in step) for step in profile.steps))
+    # The composed tone table is kept with the outputs so that the run can be reproduced. Outputs written
+    # with other settings are out of date whatever their modification time, so they are all processed again
+    tone_log = os.path.join(args.output_folder, 'tone_lut.json')
+    run_settings = json.loads(json.dumps(dict(settings, quality=args.quality)))
+    force = args.force or (not args.dicom and logged_settings(tone_log) != run_settings)
 
+    jobs = []
+    skipped = 0
+    for root, dirs, files in os.walk(args.input_folder):
+        jpg_files = glob.glob(os.path.join(root, '*.dcm' if args.dicom else '*.jpg'))
+        for jpg_file in jpg_files:
             file_name = os.path.basename(jpg_file)
-            output_path = os.path.join(args.output_folder, "processed_" + file_name)
-            cv2.imwrite(output_path, image)
\ No newline at end of file
+            if args.dicom:
+                output_path = os.path.join(args.output_folder, os.path.splitext(file_name)[0] + '.jpg')
+            else:
+                output_path = os.path.join(args.output_folder, "processed_" + file_name)
+            if not force and is_up_to_date(jpg_file, output_path):
+                skipped += 1
+            else:
+                jobs.append((jpg_file, output_path))
+    print("{} images to process, {} up to date".format(len(jobs), skipped))
+
+    failed = 0
+    start = time.time()
+    if args.shouldPlotEveryImage and not args.dicom:
+        # Plots are shown one at a time from this process
+        for done, (jpg_file, output_path) in enumerate(jobs, 1):
+            print("[{}/{}] Processing {}".format(done, len(jobs), jpg_file))
+            image = process_file(jpg_file, output_path, args.quality, return_image=True, profile=profile)
+            plt.plot()
+            plt.title("Processed Image") 
+            plt.imshow(image, cmap='gray')
+            plt.show()
+    else:
+        # Every worker decodes, enhances and encodes whole images, so these stages overlap across images
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(settings,)) as executor:
+            if args.dicom:
+                futures = {executor.submit(convert_file, jpg_file, output_path, args.grayscale, args.low_memory,
+                                           args.strip_rows): jpg_file for jpg_file, output_path in jobs}
+            else:
+                futures = {executor.submit(process_file, jpg_file, output_path, args.quality): jpg_file
+                           for jpg_file, output_path in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                    status = "Processed " + futures[future]
+                    if args.dicom:
+                        status += ", peak memory {:.1f} MB".format(result / 2 ** 20)
+                except Exception as e:
+                    failed += 1
+                    status = "Failed {}: {}".format(futures[future], e)
+                elapsed = time.time() - start
+                print("[{}/{}] {} ({:.1f} images/s)".format(done, len(jobs), status, done / max(elapsed, 1e-9)))
+    if failed:
+        print("{} images could not be processed".format(failed))
+    elif not args.dicom:
+        # Only recorded once every output matches the settings; DICOM conversion applies no tone steps
+        save_tone_lut(tone_log, profile.steps, profile.table, run_settings)
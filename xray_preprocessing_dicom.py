@@ -1,28 +1,55 @@
 import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pydicom
 import numpy as np
 import cv2
+from xray_preprocessing import parse_tone_steps, compile_tone_lut, apply_tone_lut, save_tone_lut
+
+# Elements larger than this (the pixel data) are only read from the file when they are accessed
+DEFER_SIZE = '64 KB'
 
 def apply_gaussian_blur(image, ksize, sigma):
     return cv2.GaussianBlur(image, (ksize, ksize), sigma)
 
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5,-1], [0, -1, 0]])
+
 def apply_sharpening(image):
-    kernel = np.array([[0, -1, 0], [-1, 5,-1], [0, -1, 0]])
-    return cv2.filter2D(image, -1, kernel)
+    return cv2.filter2D(image, -1, SHARPEN_KERNEL)
+
+def create_clahe(clip_limit=2.0, tile_grid_size=(8, 8)):
+    # Build the CLAHE operator once and pass it to apply_clahe / modify_dicom_image for every image
+    return cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tuple(tile_grid_size))
 
-def apply_clahe(image):
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+def apply_clahe(image, clahe=None):
+    if clahe is None:
+        clahe = create_clahe()
     return clahe.apply(image)
 
-def modify_dicom_image(dicom_path, output_path, blur_ksize=5, blur_sigma=1, apply_sharp=True, apply_clahe=True):
-    # Load DICOM file
-    dicom = pydicom.dcmread(dicom_path)
+def window_image(image, window=None, depth=16):
+    # Map the window (low, high) of the stored values, or their full range, to unsigned 8 or 16-bit in one pass
+    maxval = (1 << depth) - 1
+    dtype = cv2.CV_16U if depth == 16 else cv2.CV_8U
+    if window is None:
+        return cv2.normalize(image, None, 0, maxval, cv2.NORM_MINMAX, dtype=dtype)
+    low, high = window
+    alpha = maxval / float(high - low)
+    return cv2.addWeighted(image, alpha, image, 0, -low * alpha, dtype=dtype)
+
+def modify_dicom_image(dicom_path, output_path, blur_ksize=5, blur_sigma=1, apply_sharp=True, apply_clahe=True, clahe=None,
+                       depth=16, window=None, tone_table=None):
+    # Load DICOM file. The pixel data is read when pixel_array is first accessed
+    dicom = pydicom.dcmread(dicom_path, defer_size=DEFER_SIZE)
 
     # Convert DICOM pixel data to numpy array
     image = dicom.pixel_array
+    dtype = image.dtype
 
-    # Normalize the image to 8-bit (0-255) for OpenCV processing
-    image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    # Window the image to 16-bit (or 8-bit, 0-255) for OpenCV processing. Blur, sharpening and CLAHE all work on
+    # uint16, so the 16-bit path keeps the precision of the detector
+    image = window_image(image, window, depth)
 
     # Apply Gaussian blur
     blurred_image = apply_gaussian_blur(image, blur_ksize, blur_sigma)
@@ -34,13 +61,18 @@ def modify_dicom_image(dicom_path, output_path, blur_ksize=5, blur_sigma=1, appl
         sharpened_image = blurred_image
 
     # Apply CLAHE if needed
+    # The apply_clahe argument hides the function of the same name here
     if apply_clahe:
-        clahe_image = apply_clahe(sharpened_image)
+        clahe_image = (clahe if clahe is not None else create_clahe()).apply(sharpened_image)
     else:
         clahe_image = sharpened_image
 
+    # Apply the gamma / tone steps, compiled for the processing depth (65536 entries at 16 bits)
+    if tone_table is not None:
+        clahe_image = apply_tone_lut(clahe_image, tone_table)
+
     # Convert the processed image back to original bit depth
-    final_image = cv2.normalize(clahe_image, None, 0, np.iinfo(dicom.pixel_array.dtype).max, cv2.NORM_MINMAX).astype(dicom.pixel_array.dtype)
+    final_image = cv2.normalize(clahe_image, None, 0, np.iinfo(dtype).max, cv2.NORM_MINMAX).astype(dtype)
 
     # Update the DICOM file with the modified pixel data
     modified_dicom = dicom.copy()
@@ -51,22 +83,133 @@ def modify_dicom_image(dicom_path, output_path, blur_ksize=5, blur_sigma=1, appl
 
     print(f"Modified DICOM image saved to: {output_path}")
 
+HEADER_FIELDS = ['Rows', 'Columns', 'NumberOfFrames', 'BitsAllocated', 'BitsStored', 'PixelRepresentation',
+                 'PhotometricInterpretation', 'WindowCenter', 'WindowWidth']
+
+def read_header(dicom_path):
+    # The pixel data is deferred and never accessed, so only the header is read
+    dicom = pydicom.dcmread(dicom_path, defer_size=DEFER_SIZE)
+    header = {field: dicom.get(field, '') for field in HEADER_FIELDS}
+    header['TransferSyntaxUID'] = dicom.file_meta.get('TransferSyntaxUID', '') if hasattr(dicom, 'file_meta') else ''
+    return header
+
+def list_dicom_files(path):
+    # A directory (searched recursively for .dcm files), a glob pattern or a single file
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '**', '*.dcm'), recursive=True))
+    if glob.has_magic(path):
+        return sorted(f for f in glob.glob(path, recursive=True) if os.path.isfile(f))
+    return [path]
+
+def output_paths(files, output_dir):
+    # Keep the layout of the inputs below their common folder, so that files with the same name in different
+    # folders do not overwrite each other
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files]) if files else ''
+    return [os.path.join(output_dir, os.path.relpath(os.path.abspath(f), root)) for f in files]
+
+def compile_tone_table(steps, depth=16):
+    # None when the steps change nothing, so that the lookup is skipped
+    table = compile_tone_lut(steps, depth)
+    return None if np.array_equal(table, np.arange(len(table))) else table
+
+# CLAHE operator and tone table of the current worker process, CLAHE objects cannot be pickled
+_clahe = None
+_tone_table = None
+
+def _init_worker(clip_limit, tile_grid_size, tone_steps=(), depth=16):
+    global _clahe, _tone_table
+    # Each worker processes a whole file, so OpenCV's own threads would only oversubscribe the cores
+    cv2.setNumThreads(1)
+    _clahe = create_clahe(clip_limit, tile_grid_size)
+    _tone_table = compile_tone_table(tone_steps, depth)
+
+def process_file(dicom_path, output_path, options):
+    """Process one file and return its report row, recording the error instead of raising."""
+    try:
+        if options.get('headers_only'):
+            return dict({'file': dicom_path, 'status': 'ok', 'error': ''}, **read_header(dicom_path))
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        modify_dicom_image(dicom_path, output_path, clahe=_clahe, tone_table=_tone_table, **options['modify'])
+        return {'file': dicom_path, 'output': output_path, 'status': 'ok', 'error': ''}
+    except Exception as e:
+        return {'file': dicom_path, 'output': output_path, 'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)}
+
+def write_report(report_path, rows):
+    fields = []
+    for row in rows:
+        fields.extend(k for k in row if k not in fields)
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Modify DICOM image with Gaussian blur, sharpening, and CLAHE.')
-    parser.add_argument('dicom_path', type=str, help='Path to the input DICOM file')
-    parser.add_argument('output_path', type=str, help='Path to save the output DICOM file')
+    parser.add_argument('dicom_path', type=str, help='Path to the input DICOM file, a directory of DICOM files or a glob pattern')
+    parser.add_argument('output_path', type=str, help='Path to save the output DICOM file (an output directory for several inputs, a csv file with --headers_only)')
     parser.add_argument('--blur_ksize', type=int, default=5, help='Kernel size for Gaussian blur')
     parser.add_argument('--blur_sigma', type=float, default=1, help='Sigma for Gaussian blur')
     parser.add_argument('--apply_sharp', action='store_true', help='Apply sharpening')
     parser.add_argument('--apply_clahe', action='store_true', help='Apply CLAHE')
+    parser.add_argument('--depth', type=int, choices=[8, 16], default=16, help='Bit depth the image is processed at')
+    parser.add_argument('--window', type=float, nargs=2, default=None, help='Range of stored pixel values mapped to the processing depth (default = full range)')
+    parser.add_argument('--gamma', type=float, default=1.0, help='Gamma for gamma correction, applied after CLAHE')
+    parser.add_argument('--tone', type=str, nargs='+', default=[], help="Point-wise steps applied after gamma correction in the same lookup table, at the processing depth, e.g. contrast:1.2,32768 gamma:0.8 window:4000,60000 complement")
+    parser.add_argument('--clip_limit', type=float, default=2.0, help='Clip limit for CLAHE')
+    parser.add_argument('--tile_grid_size', type=int, nargs=2, default=(8, 8), help='Tile grid size for CLAHE (two integers)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of files processed in parallel')
+    parser.add_argument('--headers_only', action='store_true', help='Only read the headers (no pixel data) and write them to the output csv file')
 
     args = parser.parse_args()
 
-    modify_dicom_image(
-        args.dicom_path, 
-        args.output_path, 
-        blur_ksize=args.blur_ksize, 
-        blur_sigma=args.blur_sigma, 
-        apply_sharp=args.apply_sharp, 
-        apply_clahe=args.apply_clahe
-    )
+    files = list_dicom_files(args.dicom_path)
+    tone_steps = [('gamma', args.gamma)] + parse_tone_steps(args.tone)
+    options = {
+        'headers_only': args.headers_only,
+        'modify': {
+            'blur_ksize': args.blur_ksize,
+            'blur_sigma': args.blur_sigma,
+            'apply_sharp': args.apply_sharp,
+            'apply_clahe': args.apply_clahe,
+            'depth': args.depth,
+            'window': args.window,
+        },
+    }
+
+    batch = not args.headers_only and not (len(files) == 1 and files[0] == args.dicom_path and not os.path.isdir(args.output_path))
+    if args.headers_only:
+        jobs = [(f, None) for f in files]
+    elif not batch:
+        jobs = [(files[0], args.output_path)]
+    else:
+        os.makedirs(args.output_path, exist_ok=True)
+        jobs = list(zip(files, output_paths(files, args.output_path)))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(jobs))), initializer=_init_worker,
+                             initargs=(args.clip_limit, args.tile_grid_size, tone_steps, args.depth)) as executor:
+        futures = [executor.submit(process_file, f, out, options) for f, out in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            row = future.result()
+            rows.append(row)
+            if row['status'] != 'ok':
+                print(f"[{done}/{len(jobs)}] Failed {row['file']}: {row['error']}")
+            elif args.headers_only:
+                print(f"[{done}/{len(jobs)}] Read header of {row['file']}")
+    rows.sort(key=lambda row: row['file'])
+
+    failed = [row for row in rows if row['status'] != 'ok']
+    if args.headers_only:
+        write_report(args.output_path, rows)
+        print(f"Headers of {len(rows) - len(failed)} files written to: {args.output_path}")
+    elif batch:
+        report_path = os.path.join(args.output_path, 'processing_report.csv')
+        write_report(report_path, rows)
+        print(f"{len(rows) - len(failed)} of {len(rows)} files processed, {len(failed)} failed. Report written to: {report_path}")
+    if failed:
+        raise SystemExit(1)
+    if not args.headers_only:
+        # The composed tone table is kept with the outputs so that the run can be reproduced, as xray_preprocessing does
+        tone_log = os.path.join(args.output_path if batch else os.path.dirname(args.output_path), 'tone_lut.json')
+        settings = dict(options['modify'], clip_limit=args.clip_limit, tile_grid_size=list(args.tile_grid_size), tone=tone_steps)
+        save_tone_lut(tone_log, tone_steps, compile_tone_lut(tone_steps, args.depth), settings)